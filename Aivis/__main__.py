@@ -6,42 +6,96 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 warnings.simplefilter(action='ignore', category=RuntimeWarning)
 warnings.simplefilter(action='ignore', category=UserWarning)
 
+import atexit
 import functools
-import json
+import hashlib
 import math
+import os
 import re
 import shutil
 import subprocess
 import sys
 import typer
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Annotated, Any, cast, Optional, Union
+from typing import Annotated, Any, cast, IO, Optional, Union
 
 from Aivis import __version__
 from Aivis import constants
-from Aivis import demucs
-from Aivis import prepare
 from Aivis import utils
 
 
 app = typer.Typer(help='Aivis: AI Voice Imitation System')
 
-@app.command(help='Create audio segments from audio sources.')
+# ファイル名から連番以外の文字を取り除くための正規表現
+NON_DIGIT_PATTERN = re.compile(r'\D')
+
+# 書き起こし結果に SKIP_TRANSCRIPTS のいずれかが含まれているかを判定するための正規表現
+## 1回の走査ですべてのワードを照合できるよう、エスケープしたワードを選択でつないでいる
+SKIP_TRANSCRIPTS_PATTERN = re.compile('|'.join(re.escape(skip_transcript) for skip_transcript in constants.SKIP_TRANSCRIPTS))
+
+# Bert-VITS2 の config.yml を書き換えるための正規表現
+TRAIN_DATASET_PATH_PATTERN = re.compile(r'dataset_path: "Data/.*"')
+## 推論時は dataset_path と model を 1 回の走査でまとめて書き換えられるよう、名前付きグループの選択で 1 つの正規表現にしている
+INFER_CONFIG_PATTERN = re.compile(r'(?P<dataset_path>dataset_path: ".*")|(?P<model>model: "models/.*")')
+
+@app.command(help='Create audio segments from audio sources. (Audio sources are always transcribed as Japanese.)')
 def create_segments(
     use_demucs: Annotated[bool, typer.Option(help='Use Demucs to extract voices from audio files.')] = True,
     whisper_model: Annotated[constants.ModelNameType, typer.Option(help='Whisper model name.')] = constants.ModelNameType.large_v3,
+    compute_type: Annotated[constants.ComputeType, typer.Option(help='Whisper model compute type. (int8_float16 stores weights in int8 for about half the VRAM and faster decoding on GPU; use int8 on CPU)')] = constants.ComputeType.int8_float16,
     force_transcribe: Annotated[bool, typer.Option(help='Force Whisper to transcribe audio files.')] = False,
     trim_silence: Annotated[bool, typer.Option(help='Trim silence (start and end only) from audio files.')] = True,
+    warmup: Annotated[bool, typer.Option(help='Warm up Whisper model with a short silent audio before the first transcription. (Only useful for benchmarking)')] = False,
+    no_repeat_ngram_size: Annotated[int, typer.Option(help='Prevent Whisper from repeating n-grams of this size. (0 to disable, slightly faster decoding)')] = 10,
 ):
-    # このサブコマンドでしか利用せず、かつ比較的インポートが重いモジュールはここでインポートする
-    import faster_whisper
-    import stable_whisper
+    def IsAlreadySegmented(voices_file: Path) -> bool:
+        """ 音声ファイル (またはその元になったメディアファイル) のセグメントがすでに出力されているかどうか (出力先ディレクトリが存在し、かつ拡張子を持つファイルがあるか) を返す """
+
+        folder = constants.SEGMENTS_DIR / voices_file.stem
+        if not folder.exists():
+            return False
+        ## 従来通り、拡張子を持つファイル (*.*) が1つでもあれば出力済みとみなす
+        ## .DS_Store などの隠しファイルしかない場合は出力済みとみなさない
+        ## 条件を満たすファイルが最初に見つかった時点で判定できるので、ディレクトリ内のすべてのファイルを列挙する必要はない
+        with os.scandir(folder) as entries:
+            return any(not entry.name.startswith('.') and '.' in entry.name for entry in entries)
 
     # 01-Sources ディレクトリ以下のメディアファイルを取得
     ## 処理対象のメディアファイルの拡張子は constants.SOURCE_FILE_EXTENSIONS で定義されている
-    ## アルファベット順にソートする
-    source_files = sorted(list(constants.SOURCES_DIR.glob('**/*.*')))
-    source_files = [i for i in source_files if i.suffix in constants.SOURCE_FILE_EXTENSIONS]
+    ## 拡張子で絞り込んでから、アルファベット順にソートする
+    ## os.walk() はディレクトリ内のファイル名を一度に列挙するため、ファイルごとに Path オブジェクトを作らずに拡張子を判定できる
+    source_files = sorted(
+        Path(dir_path) / file_name
+        for dir_path, _, file_names in os.walk(constants.SOURCES_DIR)
+        for file_name in file_names
+        if os.path.splitext(file_name)[1] in constants.SOURCE_FILE_EXTENSIONS
+    )
+
+    # すでにセグメントが出力されているメディアファイルは、音源分離の対象からも除外する
+    ## 02-PreparedSources/ と 03-Segments/ の出力先はどちらもメディアファイルのファイル名 (拡張子なし) から決まる
+    ## すべてのメディアファイルが処理済みの場合は、重いモジュールのインポートやモデルのロードを行わずにここで終了する
+    pending_source_files: list[Path] = []
+    for source_file in source_files:
+        if IsAlreadySegmented(source_file):
+            typer.echo('=' * utils.GetTerminalColumnSize())
+            typer.echo(f'Directory {constants.SEGMENTS_DIR / source_file.stem} already exists. Skip.')
+        else:
+            pending_source_files.append(source_file)
+    if len(pending_source_files) == 0:
+        typer.echo('=' * utils.GetTerminalColumnSize())
+        typer.echo('All files segmentation done.')
+        typer.echo('=' * utils.GetTerminalColumnSize())
+        return
+
+    # このサブコマンドでしか利用せず、かつ比較的インポートが重いモジュールはここでインポートする
+    import faster_whisper
+    import numpy as np
+    import soundfile
+    import stable_whisper
+    import torch
+    from Aivis import demucs
+    from Aivis import prepare
 
     # Demucs V4 (htdemucs_ft) で AI 音源分離を行い、音声ファイルからボイスのみを抽出する
     ## 本来は楽曲をボーカル・ドラム・ベース・その他に音源分離するための AI だが、これを応用して BGM・SE・ノイズなどを大部分除去できる
@@ -49,197 +103,332 @@ def create_segments(
     ## すでに抽出済みのファイルがある場合は音源分離は行われず、すでに抽出済みのファイルを使用する
     ## Demucs での音源分離を行わない場合は、音声ファイルを wav に変換して 02-PreparedSources/(音声ファイル名).wav に出力する
     if use_demucs is True:
-        voices_files = demucs.ExtractVoices(source_files, constants.PREPARE_SOURCES_DIR)
+        voices_files = demucs.ExtractVoices(pending_source_files, constants.PREPARE_SOURCES_DIR)
     else:
-        voices_files = demucs.ConvertToWave(source_files, constants.PREPARE_SOURCES_DIR)
+        voices_files = demucs.ConvertToWave(pending_source_files, constants.PREPARE_SOURCES_DIR)
+
+    # 長い音声ファイルから順に処理する
+    ## セグメントの切り出しは次の音声ファイルの書き起こしと並行して実行されるが、最後の音声ファイルの切り出しだけは並行できない
+    ## 短い音声ファイルを最後に回すことで、最後に待たされる時間を短くできる
+    ## 音声ファイルの長さは WAV のヘッダーから取得できるため、音声ファイル全体をデコードする必要はない
+    voices_files.sort(key=lambda voices_file: soundfile.info(voices_file).duration, reverse=True)
 
     model: faster_whisper.WhisperModel | None = None
 
-    # ここからは各音声ファイルごとにループ
-    for voices_file in voices_files:
-        typer.echo('=' * utils.GetTerminalColumnSize())
+    # バックグラウンドで実行中のセグメントの切り出し処理
+    slice_job: tuple[Path, Future[list[Path]]] | None = None
 
-        # 出力先ディレクトリを作成
-        ## すでに存在している場合は生成済みなのでスキップ (ただし、ディレクトリの中身が空の場合はスキップしない)
-        ## もしもう一度生成したい場合はディレクトリを削除すること
-        folder = constants.SEGMENTS_DIR / voices_file.name.split('.')[0]
-        if folder.exists() and len(list(folder.glob('*.*'))) > 0:
-            typer.echo(f'Directory {folder} already exists. Skip.')
-            continue
-        folder.mkdir(parents=True, exist_ok=True)
-        typer.echo(f'Directory {folder} created.')
+    def WaitForSliceJob() -> None:
+        """ バックグラウンドで実行中のセグメントの切り出し処理が完了するまで待つ """
 
-        transcribe_result: stable_whisper.WhisperResult
-        results_json_file = constants.PREPARE_SOURCES_DIR / f'{voices_file.name.split(".")[0]}.json'
+        nonlocal slice_job
 
-        # すでに音声認識結果のデータ (JSON) が保存されている場合はそのデータを使い、新規の音声認識は行わない
-        ## なお、--force-transcribe オプションが指定されている場合は JSON ファイルが存在するかに関わらず音声認識を実行する
-        if results_json_file.exists() and force_transcribe is False:
-            typer.echo(f'File {voices_file} already transcribed.')
-            transcribe_result = stable_whisper.WhisperResult(str(results_json_file))
+        if slice_job is None:
+            return
+        slice_voices_file, slice_future = slice_job
+        slice_job = None
 
-        # Whisper で音声認識を実行
-        else:
+        typer.echo('-' * utils.GetTerminalColumnSize())
+        for real_output_audio_file in slice_future.result():
+            typer.echo(f'File {real_output_audio_file} saved.')
+        typer.echo(f'File {slice_voices_file} segmentation done.')
+
+    # セグメントの切り出し元の音声データのサンプリングレート
+    audio_sample_rate = 44100
+
+    def DecodeVoicesFile(voices_file: Path) -> tuple[np.ndarray | None, np.ndarray]:
+        """
+        音声ファイルをデコードし、Whisper に入力する 16kHz の音声データと、セグメントの切り出し元の 44.1kHz の音声データを返す
+        すでに書き起こし済みで Whisper に入力する必要がない場合、16kHz の音声データは None になる
+        """
+
+        whisper_audio = None
+        results_json_file = constants.PREPARE_SOURCES_DIR / f'{voices_file.stem}.json'
+        if not results_json_file.exists() or force_transcribe is True:
+            whisper_audio = faster_whisper.decode_audio(str(voices_file), sampling_rate=16000)
+
+        return whisper_audio, prepare.LoadAudioFile(voices_file, sample_rate=audio_sample_rate)
+
+    # バックグラウンドで先行して実行中の音声ファイルのデコード処理
+    decode_job: tuple[Path, Future[tuple[np.ndarray | None, np.ndarray]]] | None = None
+
+    # セグメントの切り出し処理と、音声ファイルのデコード処理をバックグラウンドで実行するためのスレッドプール
+    ## 切り出し処理は CPU 側で完結するため、次の音声ファイルの書き起こし (GPU) と並行して実行できる
+    ## 切り出し元の音声データをメモリに載せたまま処理が溜まらないように、同時に実行する切り出し処理は1つまでにしている
+    ## 現在の音声ファイルを書き起こしている間に次の音声ファイルをデコードしておくことで、GPU がデコード待ちで遊ぶ時間を減らす
+    ## 先行してデコードするのは次の1ファイルだけにして、メモリ上に載る音声データが増えすぎないようにしている
+    ## 途中で例外が発生した場合も、with ブロックを抜ける際に実行中のバックグラウンド処理の終了を待ってから抜ける
+    with ThreadPoolExecutor(max_workers=1) as slice_executor, ThreadPoolExecutor(max_workers=1) as decode_executor:
+        # ここからは各音声ファイルごとにループ
+        for voices_index, voices_file in enumerate(voices_files):
+            typer.echo('=' * utils.GetTerminalColumnSize())
 
-            typer.echo('-' * utils.GetTerminalColumnSize())
-            typer.echo(f'File {voices_file} transcribing...')
-            typer.echo('-' * utils.GetTerminalColumnSize())
+            # 出力先ディレクトリを作成
+            ## すでに存在している場合は生成済みなのでスキップ (ただし、ディレクトリの中身が空の場合はスキップしない)
+            ## もしもう一度生成したい場合はディレクトリを削除すること
+            ## 同じファイル名 (拡張子なし) の音声ファイルをバックグラウンドで切り出している途中だと、出力先ディレクトリがまだ空のため、
+            ## 切り出しの完了を待ってから判定しないと同じ出力先に二重にセグメントを出力してしまう
+            folder = constants.SEGMENTS_DIR / voices_file.stem
+            if slice_job is not None and slice_job[0].stem == voices_file.stem:
+                WaitForSliceJob()
+            if IsAlreadySegmented(voices_file):
+                typer.echo(f'Directory {folder} already exists. Skip.')
+                continue
+            folder.mkdir(parents=True, exist_ok=True)
+            typer.echo(f'Directory {folder} created.')
+
+            # 現在の音声ファイルのデコード結果を取得する (先行してデコードされていない場合はここでデコードを開始する)
+            if decode_job is not None and decode_job[0] == voices_file:
+                decode_future = decode_job[1]
+            else:
+                decode_future = decode_executor.submit(DecodeVoicesFile, voices_file)
+            decode_job = None
+
+            # 次に処理する (スキップされない) 音声ファイルのデコードをバックグラウンドで開始する
+            ## 現在の音声ファイルと同じファイル名 (拡張子なし) の音声ファイルは、現在の音声ファイルの切り出し後にスキップされるため先行してデコードしない
+            for next_voices_file in voices_files[voices_index + 1:]:
+                if next_voices_file.stem != voices_file.stem and not IsAlreadySegmented(next_voices_file):
+                    decode_job = (next_voices_file, decode_executor.submit(DecodeVoicesFile, next_voices_file))
+                    break
+
+            whisper_audio, audio = decode_future.result()
+            ## Future はデコード結果のタプルを保持し続けるため、取り出したら参照を捨てて、後で 16kHz の音声データを解放できるようにする
+            del decode_future
+
+            transcribe_result: stable_whisper.WhisperResult
+            results_json_file = constants.PREPARE_SOURCES_DIR / f'{voices_file.stem}.json'
+
+            # すでに音声認識結果のデータ (JSON) が保存されている場合はそのデータを使い、新規の音声認識は行わない
+            ## なお、--force-transcribe オプションが指定されている場合は JSON ファイルが存在するかに関わらず音声認識を実行する
+            if results_json_file.exists() and force_transcribe is False:
+                typer.echo(f'File {voices_file} already transcribed.')
+                transcribe_result = stable_whisper.WhisperResult(utils.LoadJSONFile(results_json_file))
+
+            # Whisper で音声認識を実行
+            else:
 
-            # Whisper の学習済みモデルをロード (1回のみ)
-            if model is None:
-                typer.echo(f'Whisper model loading... (Model: {whisper_model.value})')
-                model = stable_whisper.load_faster_whisper(
-                    whisper_model.value,
-                    device = 'cuda',
-                    compute_type = 'auto',
-                )
-                typer.echo('Whisper model loaded.')
+                typer.echo('-' * utils.GetTerminalColumnSize())
+                typer.echo(f'File {voices_file} transcribing...')
                 typer.echo('-' * utils.GetTerminalColumnSize())
 
-            # Whisper に入力する初期プロンプト (呪文)
-            ## Whisper は前の文脈を踏まえて書き起こしてくれるらしいので、会話文の書き起こしっぽいものを入れておくと、
-            ## 書き起こしに句読点をつけるよう誘導できるみたい…
-            initial_prompt = (
-                'そうだ。今日はピクニックしない…？天気もいいし、絶好のピクニック日和だと思う！ 良いですね！行きましょう…！'
-                'じゃあ早速、荷物の準備しておきますね。 そうだね！どこに行く？ そうですね…。桜の見える公園なんかどうでしょう…？'
-                'おー！今の時期は桜が綺麗だしね。じゃあそれで決まりっ！ 分かりました。調べたところ、電車だと550円掛かるみたいです。'
-                '少し時間が掛かりますが、歩いた方が健康的かもしれません。 え〜！歩くのはきついよぉ…。'
-            )
+                # Whisper の学習済みモデルをロード (1回のみ)
+                if model is None:
+                    typer.echo(f'Whisper model loading... (Model: {whisper_model.value} / Compute Type: {compute_type.value})')
+                    model = stable_whisper.load_faster_whisper(
+                        whisper_model.value,
+                        device = 'cuda',
+                        # int8_float16 では重みを int8 で保持するため、float16 と比べて VRAM 使用量を大幅に削減できる
+                        ## 精度に問題がある場合は --compute-type float16 を指定する
+                        compute_type = compute_type.value,
+                        # VAD や特徴量抽出など CPU 側で行われる処理のスレッド数
+                        cpu_threads = os.cpu_count() or 0,
+                    )
+
+                    # 1秒間の無音を空で書き起こし、CUDA カーネルの初期化などの初回実行時のみ掛かる処理を済ませておく
+                    ## faster-whisper の transcribe() はジェネレーターを返すため、最後まで消費しないと書き起こしが実行されない
+                    if warmup is True:
+                        warmup_segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), language='ja', beam_size=1, vad_filter=False)
+                        list(warmup_segments)
+                    typer.echo('Whisper model loaded.')
+                    typer.echo('-' * utils.GetTerminalColumnSize())
+
+                # Whisper に入力する初期プロンプト (呪文)
+                ## Whisper は前の文脈を踏まえて書き起こしてくれるらしいので、会話文の書き起こしっぽいものを入れておくと、
+                ## 書き起こしに句読点をつけるよう誘導できるみたい…
+                initial_prompt = (
+                    'そうだ。今日はピクニックしない…？天気もいいし、絶好のピクニック日和だと思う！ 良いですね！行きましょう…！'
+                    'じゃあ早速、荷物の準備しておきますね。 そうだね！どこに行く？ そうですね…。桜の見える公園なんかどうでしょう…？'
+                    'おー！今の時期は桜が綺麗だしね。じゃあそれで決まりっ！ 分かりました。調べたところ、電車だと550円掛かるみたいです。'
+                    '少し時間が掛かりますが、歩いた方が健康的かもしれません。 え〜！歩くのはきついよぉ…。'
+                )
 
-            # 音声認識を実行し、タイムスタンプなどが調整された音声認識結果を取得する
-            # ref: https://qiita.com/reriiasu/items/5ad8e1a7dbc425de7bb0
-            # ref: https://zenn.dev/tsuzukia/articles/1381e6c9a88577
-            # ref: https://note.com/asahi_ictrad/n/nf3ca329f17df
-            transcribe_result: stable_whisper.WhisperResult = cast(Any, model).transcribe_stable(
-                # 入力元の音声ファイル
-                str(voices_file),
-                # 単語ごとのタイムスタンプを出力する
-                word_timestamps = True,
-                # ログをコンソールに出力する
-                verbose = True,
-                # 単語セグメントの再グループ化を行わない
-                ## 別途音声認識が完了してから行う
-                regroup = False,
-                # すでに Demucs で音源分離を行っているため、ここでは音源分離を行わない
-                ## 音声ファイルごとにモデルを読み込むよりも、読み込んだモデルを使いまわした方が高速に処理できる
-                demucs = False,
-                # 検出された無音に基づいてタイムスタンプの調整を有効にする
-                suppress_silence = True,
-                # 検出された無音に基づいて単語のタイムスタンプを調整する
-                suppress_word_ts = True,
-                # Silero VAD を使用してタイムスタンプ抑制マスクを生成する
-                vad = True,
-                # faster-whisper 本体の設定パラメータ
-                # 日本語
-                language = 'ja',
-                # beam_size (1 に設定して CER を下げる)
-                beam_size = 1,
-                # 謎のパラメータ (10 に設定すると temperature を下げたことで上がる repetition を抑えられるらしい？)
-                no_repeat_ngram_size = 10,
-                # temperature (0.0 に設定して CER を下げる)
-                temperature = 0.0,
-                # 前回の音声チャンクの出力結果を次のウインドウのプロンプトに設定しない
-                condition_on_previous_text = False,
-                # 初期プロンプト
-                initial_prompt = initial_prompt,
-                # faster-whisper 側で VAD を使った無音フィルタリングを行う
-                vad_filter = True,
+                # 音声認識を実行し、タイムスタンプなどが調整された音声認識結果を取得する
+                # ref: https://qiita.com/reriiasu/items/5ad8e1a7dbc425de7bb0
+                # ref: https://zenn.dev/tsuzukia/articles/1381e6c9a88577
+                # ref: https://note.com/asahi_ictrad/n/nf3ca329f17df
+                ## stable-ts は Silero VAD や無音検出によるタイムスタンプの調整に PyTorch を使うため、
+                ## 勾配の記録を完全に無効にする inference_mode で実行する (Whisper 本体の推論は CTranslate2 側で行われる)
+                with torch.inference_mode():
+                    transcribe_result: stable_whisper.WhisperResult = cast(Any, model).transcribe_stable(
+                        # 入力元の音声データ (16kHz)
+                        ## 音声ファイルのパスを渡すと faster-whisper 側で再度デコードされるため、デコード済みの音声データを渡す
+                        whisper_audio,
+                        # 単語ごとのタイムスタンプを出力する
+                        word_timestamps = True,
+                        # ログをコンソールに出力する
+                        verbose = True,
+                        # 単語セグメントの再グループ化を行わない
+                        ## 別途音声認識が完了してから行う
+                        regroup = False,
+                        # すでに Demucs で音源分離を行っているため、ここでは音源分離を行わない
+                        ## 音声ファイルごとにモデルを読み込むよりも、読み込んだモデルを使いまわした方が高速に処理できる
+                        demucs = False,
+                        # 検出された無音に基づいてタイムスタンプの調整を有効にする
+                        suppress_silence = True,
+                        # 検出された無音に基づいて単語のタイムスタンプを調整する
+                        suppress_word_ts = True,
+                        # Silero VAD を使用してタイムスタンプ抑制マスクを生成する
+                        vad = True,
+                        # faster-whisper 本体の設定パラメータ
+                        # 日本語
+                        ## 言語を明示的に指定しているので、faster-whisper 側での言語判定 (エンコーダーの追加の推論) は行われない
+                        language = 'ja',
+                        # beam_size (1 に設定して CER を下げる)
+                        beam_size = 1,
+                        # 謎のパラメータ (10 に設定すると temperature を下げたことで上がる repetition を抑えられるらしい？)
+                        ## デコードの各ステップで n-gram の照合が行われるため、0 (無効) にするとわずかに高速になる
+                        no_repeat_ngram_size = no_repeat_ngram_size,
+                        # temperature (0.0 に設定して CER を下げる)
+                        temperature = 0.0,
+                        # 前回の音声チャンクの出力結果を次のウインドウのプロンプトに設定しない
+                        condition_on_previous_text = False,
+                        # 初期プロンプト
+                        initial_prompt = initial_prompt,
+                        # faster-whisper 側で VAD を使った無音フィルタリングを行う
+                        vad_filter = True,
+                    )
+                typer.echo('-' * utils.GetTerminalColumnSize())
+                typer.echo(f'File {voices_file} transcribed.')
+
+                # 音声認識結果を再グループ化する
+                ## 再グループ化のアルゴリズムは多くあるが、ここではデフォルト設定を調整して使っている
+                ## ref: https://github.com/jianfch/stable-ts#regrouping-words
+                (transcribe_result.clamp_max()
+                    .split_by_punctuation([('.', ' '), '。', '?', '？', (',', ' '), '，'])  # type: ignore
+                    .split_by_gap(0.75)
+                    .merge_by_gap(0.3, max_words=3)
+                    .split_by_punctuation([('.', ' '), '。', '?', '？']))  # type: ignore
+
+                # 音声認識結果をファイルに出力する
+                utils.SaveJSONFile(results_json_file, transcribe_result.to_dict())
+
+            # 16kHz の音声データは書き起こしにしか使わないので、セグメントの切り出しを始める前に解放する
+            ## セグメントの切り出しはすべて 44.1kHz モノラルの音声データ (audio) から行う (セグメントごとに音声ファイルをデコードし直すことはない)
+            del whisper_audio
+
+            # 音声ファイルの長さを取得する
+            ## 最後のセグメントの終了位置の調整に使う
+            audio_duration = len(audio) / audio_sample_rate
+
+            # 各セグメントの開始時間・終了時間・最初の単語の長さを NumPy 配列にまとめる
+            ## セグメントのリストは一度だけ取り出し、以降は添字アクセスせずにこの配列だけを参照する
+            ## 単語を持たないセグメントは最初の単語の長さを 0.0 秒として扱い、境界の調整を行わない
+            segments = list(transcribe_result.segments)
+            starts = np.array([segment.start for segment in segments], dtype=np.float64)
+            ends = np.array([segment.end for segment in segments], dtype=np.float64)
+            first_word_durations = np.array(
+                [segment.words[0].duration if segment.words else 0.0 for segment in segments],
+                dtype=np.float64,
             )
-            typer.echo('-' * utils.GetTerminalColumnSize())
-            typer.echo(f'File {voices_file} transcribed.')
-
-            # 音声認識結果を再グループ化する
-            ## 再グループ化のアルゴリズムは多くあるが、ここではデフォルト設定を調整して使っている
-            ## ref: https://github.com/jianfch/stable-ts#regrouping-words
-            (transcribe_result.clamp_max()
-                .split_by_punctuation([('.', ' '), '。', '?', '？', (',', ' '), '，'])  # type: ignore
-                .split_by_gap(0.75)
-                .merge_by_gap(0.3, max_words=3)
-                .split_by_punctuation([('.', ' '), '。', '?', '？']))  # type: ignore
-
-            # 音声認識結果をファイルに出力する
-            with open(results_json_file, mode='w', encoding='utf-8') as f:
-                json.dump(transcribe_result.to_dict(), f, indent=4, ensure_ascii=False, allow_nan=True)
-
-        # 一文ごとに切り出した音声ファイル（ファイル名には書き起こし文が入る）を出力する
-        count = 1
-        for index, segment in enumerate(transcribe_result.segments):
-            typer.echo('-' * utils.GetTerminalColumnSize())
-
-            # 書き起こし結果を下処理し、よりデータセットとして最適な形にする
-            transcript = prepare.PrepareText(segment.text)
-            typer.echo(f'Transcript: {transcript}')
-
-            # Whisper は無音区間とかがあると「視聴頂きありがとうございました」「チャンネル登録よろしく」などの謎のハルシネーションが発生するので、
-            # そういう系の書き起こし結果があった場合はスキップする
-            if transcript in constants.SKIP_TRANSCRIPTS:
-                typer.echo(f'Transcript skipped. (Transcript is in SKIP_TRANSCRIPTS)')
-                continue
-
-            # (句読点含めて) 書き起こし結果が4文字未満だった場合、データセットにするには短すぎるためスキップする
-            ## 例: そう。/ まじ？ / あ。
-            if len(transcript) < 4:
-                typer.echo(f'Transcript skipped. (Transcript length < 4 characters)')
-                continue
-
-            # セグメントの開始時間と終了時間を取得
-            segment_start = segment.start
-            segment_end = segment.end
 
             # もし現在処理中のセグメントの最初の単語の長さが 0.425 秒以上だった場合、先頭 0.25 秒を削る
             ## 前のセグメントの最後の発音の母音が含まれてしまう問題の回避策
             ## 日本語の場合単語は基本1文字か2文字になるため、発声時間は 0.425 秒以下になることが多いのを利用している
-            if segment.words[0].duration >= 0.425:
-                segment_start += 0.25
-
-                # さらに、もし現在処理中のセグメントの最初の単語の長さが 1 秒以上だった場合、
-                # その長さ - 1 秒をさらに削る (最低でも 0.75 秒は残す)
-                ## 例: 3.6 秒ある単語なら、先頭 0.25 秒 + 2.6 秒 = 先頭 2.85 秒を削り、残りの 0.75 秒を出力する
-                ## 1単語の発声に 1 秒以上掛かることはほぼあり得ないため、無音区間が含まれていると判断する
-                if segment.words[0].duration >= 1.0:
-                    segment_start += segment.words[0].duration - 1.0
+            # さらに、もし現在処理中のセグメントの最初の単語の長さが 1 秒以上だった場合、
+            # その長さ - 1 秒をさらに削る (最低でも 0.75 秒は残す)
+            ## 例: 3.6 秒ある単語なら、先頭 0.25 秒 + 2.6 秒 = 先頭 2.85 秒を削り、残りの 0.75 秒を出力する
+            ## 1単語の発声に 1 秒以上掛かることはほぼあり得ないため、無音区間が含まれていると判断する
+            segment_starts = (starts
+                + np.where(first_word_durations >= 0.425, 0.25, 0.0)
+                + np.where(first_word_durations >= 1.0, first_word_durations - 1.0, 0.0))
 
             # もし次のセグメントの最初の単語の長さが 0.425 秒以上だった場合、末尾 0.25 秒を伸ばす
             ## 最後の発音の母音が切れてしまう問題の回避策
-            if index + 1 < len(transcribe_result.segments) and transcribe_result.segments[index + 1].words[0].duration >= 0.425:
-                segment_end += 0.25
-
-                # さらに、もし次のセグメントの最初の単語の長さが 1 秒以上だった場合、
-                # その長さ - 1 秒をさらに伸ばす (最大で 1.0 秒まで伸ばす)
-                if transcribe_result.segments[index + 1].words[0].duration >= 1.0:
-                    segment_end += min(transcribe_result.segments[index + 1].words[0].duration - 1.0, 1.0)
+            # さらに、もし次のセグメントの最初の単語の長さが 1 秒以上だった場合、
+            # その長さ - 1 秒をさらに伸ばす (最大で 1.0 秒まで伸ばす)
+            next_first_word_durations = first_word_durations[1:]
+            next_starts = starts[1:]
+            segment_ends = ends.copy()
+            segment_ends[:-1] += (np.where(next_first_word_durations >= 0.425, 0.25, 0.0)
+                + np.where(next_first_word_durations >= 1.0, np.minimum(next_first_word_durations - 1.0, 1.0), 0.0))
 
             # もし次のセグメントの開始位置が現在処理中のセグメントの終了位置よりも後なら、
             # 現在処理中のセグメントの終了位置を次のセグメントの開始位置に合わせて末尾が欠けないようにする (最大で 3.0 秒まで伸ばす)
-            if index + 1 < len(transcribe_result.segments) and segment_end < transcribe_result.segments[index + 1].start:
-                segment_end = min(transcribe_result.segments[index + 1].start, segment_end + 3.0)
-
-            # もし現在処理中のセグメントが音声認識結果の最後のセグメントなら、
-            # 現在処理中のセグメントの終了位置を音声の長さに合わせて末尾が欠けないようにする
-            if index + 1 == len(transcribe_result.segments):
-                segment_end = prepare.GetAudioFileDuration(voices_file)
-
-            typer.echo(f'Segment Range: {utils.SecondToTimeCode(segment_start)} - {utils.SecondToTimeCode(segment_end)}')
-
-            # 開始時刻と終了時刻が同じだった場合、タイムスタンプが正しく取得できていないためスキップする
-            if segment_start == segment_end:
-                typer.echo(f'Transcript skipped. (Start time == End time)')
-                continue
-
-             # 出力する音声ファイルの長さが1秒未満になった場合、データセットにするには短すぎるためスキップする
-            if segment_end - segment_start < 1:
-                typer.echo(f'Transcript skipped. (Duration < 1 sec)')
-                continue
-
-            # 出力先の音声ファイルのパス
-            # 例: 0001_こんにちは.wav
-            output_audio_file = folder / f'{count:04d}_{transcript}.wav'
+            segment_ends[:-1] = np.where(
+                segment_ends[:-1] < next_starts,
+                np.minimum(next_starts, segment_ends[:-1] + 3.0),
+                segment_ends[:-1],
+            )
 
-            # 一文ごとに切り出した (セグメント化した) 音声ファイルを出力
-            real_output_audio_file = prepare.SliceAudioFile(voices_file, output_audio_file, segment_start, segment_end, trim_silence)
-
-            typer.echo(f'File {real_output_audio_file} saved.')
-            count += 1
+            # 最後のセグメントの終了位置を音声の長さに合わせて末尾が欠けないようにする
+            if len(segments) > 0:
+                segment_ends[-1] = audio_duration
+
+            # 伸ばした結果、開始位置・終了位置が音声の範囲外にはみ出さないようにする
+            ## はみ出したままだと、実際に切り出される音声の長さとセグメントの長さが一致しなくなる
+            segment_starts = np.clip(segment_starts, 0.0, audio_duration)
+            segment_ends = np.clip(segment_ends, 0.0, audio_duration)
+
+            # 一文ごとに切り出す音声ファイル（ファイル名には書き起こし文が入る）の出力先と切り出し範囲を収集する
+            ## 実際の切り出しは、すべてのセグメントの切り出し範囲が確定した後にまとめて行う
+            count = 1
+            slices: list[tuple[Path, float, float]] = []
+            ## セグメントごとのログは1行ずつ出力せず、すべてのセグメントを処理し終えてからまとめて出力する
+            segment_logs: list[str] = []
+            for index, segment in enumerate(segments):
+                segment_logs.append('-' * utils.GetTerminalColumnSize())
+
+                # Whisper は無音区間とかがあると「視聴頂きありがとうございました」「チャンネル登録よろしく」などの謎のハルシネーションが発生するので、
+                # そういう系の書き起こし結果があった場合はスキップする
+                ## SKIP_TRANSCRIPTS はハルシネーションの一部分なので、書き起こし結果に含まれているかで判定する
+                ## 捨てるセグメントに対して PrepareText() を実行しても無駄なので、下処理前の書き起こし結果の時点で判定する
+                raw_transcript = segment.text.strip()
+                if SKIP_TRANSCRIPTS_PATTERN.search(raw_transcript) is not None:
+                    segment_logs.append(f'Transcript: {raw_transcript}')
+                    segment_logs.append(f'Transcript skipped. (Transcript is in SKIP_TRANSCRIPTS)')
+                    continue
+
+                # PrepareText() で増える文字数は末尾の句点の1文字だけなので、下処理前の時点で3文字未満なら下処理後も4文字未満になる
+                ## 空文字列の書き起こし結果もここで弾かれる
+                if len(raw_transcript) < 3:
+                    segment_logs.append(f'Transcript: {raw_transcript}')
+                    segment_logs.append(f'Transcript skipped. (Transcript length < 4 characters)')
+                    continue
+
+                # 書き起こし結果を下処理し、よりデータセットとして最適な形にする
+                transcript = prepare.PrepareText(raw_transcript)
+                segment_logs.append(f'Transcript: {transcript}')
+
+                # (句読点含めて) 書き起こし結果が4文字未満だった場合、データセットにするには短すぎるためスキップする
+                ## 例: そう。/ まじ？ / あ。
+                if len(transcript) < 4:
+                    segment_logs.append(f'Transcript skipped. (Transcript length < 4 characters)')
+                    continue
+
+                # 調整済みのセグメントの開始時間と終了時間を取得
+                segment_start = float(segment_starts[index])
+                segment_end = float(segment_ends[index])
+
+                segment_logs.append(f'Segment Range: {utils.SecondToTimeCode(segment_start)} - {utils.SecondToTimeCode(segment_end)}')
+
+                # 開始時刻と終了時刻が同じだった場合、タイムスタンプが正しく取得できていないためスキップする
+                if segment_start == segment_end:
+                    segment_logs.append(f'Transcript skipped. (Start time == End time)')
+                    continue
+
+                 # 出力する音声ファイルの長さが1秒未満になった場合、データセットにするには短すぎるためスキップする
+                if segment_end - segment_start < 1:
+                    segment_logs.append(f'Transcript skipped. (Duration < 1 sec)')
+                    continue
+
+                # 出力先の音声ファイルのパス
+                # 例: 0001_こんにちは.wav
+                output_audio_file = folder / f'{count:04d}_{transcript}.wav'
+
+                slices.append((output_audio_file, segment_start, segment_end))
+                count += 1
+
+            if len(segment_logs) > 0:
+                typer.echo('\n'.join(segment_logs))
+
+            # 前の音声ファイルのセグメントの切り出しが終わるまで待つ
+            WaitForSliceJob()
+
+            # 一文ごとに切り出した (セグメント化した) 音声ファイルをバックグラウンドでまとめて出力
+            slice_job = (voices_file, slice_executor.submit(prepare.SliceAudioFiles, audio, audio_sample_rate, slices, trim_silence))
+
+        # 最後の音声ファイルのセグメントの切り出しが終わるまで待つ
+        WaitForSliceJob()
 
     typer.echo('=' * utils.GetTerminalColumnSize())
     typer.echo('All files segmentation done.')
@@ -254,6 +443,7 @@ def create_datasets(
 ):
     # このサブコマンドでしか利用せず、かつ比較的インポートが重いモジュールはここでインポートする
     import gradio
+    import soundfile
     from gradio import WaveformOptions
 
     typer.echo('=' * utils.GetTerminalColumnSize())
@@ -277,8 +467,15 @@ def create_datasets(
 
     # 03-Segments/(指定されたディレクトリ名の Glob パターン)/ 以下のセグメント化された音声ファイルを取得
     ## 拡張子は .wav
-    ## glob() の結果は順序がバラバラなのでアルファベット順にソートする
-    segment_audio_paths = sorted(list((constants.SEGMENTS_DIR).glob(f'{segments_dir_name}/*.wav')))
+    ## Glob パターンはディレクトリの絞り込みにだけ使い、各ディレクトリ内の音声ファイルは os.scandir() で列挙して拡張子を判定する
+    ## 列挙の結果は順序がバラバラなのでアルファベット順にソートする
+    segment_audio_paths: list[Path] = []
+    for segments_dir in constants.SEGMENTS_DIR.glob(segments_dir_name):
+        if not segments_dir.is_dir():
+            continue
+        with os.scandir(segments_dir) as entries:
+            segment_audio_paths.extend(Path(entry.path) for entry in entries if entry.name.endswith('.wav') and entry.is_file())
+    segment_audio_paths.sort()
     if len(segment_audio_paths) == 0:
         typer.echo(f'Error: {segments_dir_name}/*.wav glob pattern matched no files.')
         typer.echo('=' * utils.GetTerminalColumnSize())
@@ -288,10 +485,15 @@ def create_datasets(
         typer.echo(f'Segment File: {segments_dir_name}/{segment_audio_path.name}')
     typer.echo('=' * utils.GetTerminalColumnSize())
 
-    # 音声ファイル名から書き起こし文を取得
-    ## 例: 0001_こんにちは.wav -> こんにちは
-    segment_audio_transcripts: list[str] = []
-    for segment_audio_path in segment_audio_paths:
+    @functools.lru_cache(maxsize=None)
+    def GetSegmentAudioTranscript(segment_audio_path: Path) -> str:
+        """
+        音声ファイル名から書き起こし文を取得する
+        例: 0001_こんにちは.wav -> こんにちは
+
+        UI の起動前にすべてのセグメントの書き起こし文を読み込むと、セグメント数に比例して起動が遅くなるため、
+        実際に表示・保存するセグメントの分だけ必要になったタイミングで読み込む
+        """
 
         # 拡張子なしファイル名から _ より後の部分を取得
         segment_audio_transcript = segment_audio_path.stem.split('_')[1]
@@ -300,11 +502,9 @@ def create_datasets(
         # それを読み込んで使う
         segment_audio_transcript_txt = segment_audio_path.with_suffix('.txt')
         if segment_audio_transcript_txt.exists():
-            with open(segment_audio_transcript_txt, mode='r', encoding='utf-8') as f:
-                segment_audio_transcript = f.read()
+            segment_audio_transcript = segment_audio_transcript_txt.read_text(encoding='utf-8')
 
-        # 書き起こし文をリストに追加
-        segment_audio_transcripts.append(segment_audio_transcript)
+        return segment_audio_transcript
 
     # 現在処理中の音声ファイルのインデックスと音声ファイルのパスと書き起こし文
     current_index = 0
@@ -316,9 +516,83 @@ def create_datasets(
     output_audio_count: dict[str, int] = {}
     for speaker in speaker_name_list:
         # 既にそのディレクトリに存在するファイルの中で連番が一番大きいものを取得し、それに 1 を足したものを初期値とする
-        output_audio_count[speaker] = max([
-            int(re.sub(r'\D', '', i.stem)) for i in (constants.DATASETS_DIR / speaker / 'audios').glob('*.wav')
-        ], default=0) + 1
+        ## ファイル名は基本 0001.wav のような連番なので、まずはそのまま数値に変換し、失敗した場合のみ正規表現で数字だけを取り出す
+        ## os.scandir() で列挙したファイル名を直接扱い、ファイルごとに Path オブジェクトを作らないようにしている
+        serial_numbers: list[int] = []
+        audio_output_dir = constants.DATASETS_DIR / speaker / 'audios'
+        if audio_output_dir.exists():
+            with os.scandir(audio_output_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.wav'):
+                        continue
+                    stem = entry.name[:-len('.wav')]
+                    try:
+                        serial_numbers.append(int(stem))
+                    except ValueError:
+                        ## 数字を1文字も含まないファイル名は連番の計算から除外する
+                        digits = NON_DIGIT_PATTERN.sub('', stem)
+                        if digits != '':
+                            serial_numbers.append(int(digits))
+        output_audio_count[speaker] = max(serial_numbers, default=0) + 1
+
+    # 話者ごとの transcripts.list のファイルハンドル
+    ## 確定のたびにファイルを開き直すのではなく、話者ごとに一度だけ開いたハンドルに行単位で追記していく
+    ## 行バッファリングで開くので、1行書き込むごとに確実にファイルに反映される
+    text_list_files: dict[str, IO[str]] = {}
+
+    def GetTextListFile(speaker_name: str) -> IO[str]:
+        """ 話者の transcripts.list のファイルハンドルを取得する (初回のみファイルを開く) """
+        if speaker_name not in text_list_files:
+            text_list_path = constants.DATASETS_DIR / speaker_name / 'transcripts.list'
+            text_list_path.parent.mkdir(parents=True, exist_ok=True)
+            text_list_files[speaker_name] = open(text_list_path, mode='a', encoding='utf-8', buffering=1)
+        return text_list_files[speaker_name]
+
+    def CloseTextListFiles() -> None:
+        """ 開いている transcripts.list のファイルハンドルをすべて閉じる """
+        for text_list_file in text_list_files.values():
+            text_list_file.close()
+        text_list_files.clear()
+
+    ## Gradio の UI はプロセスが終了されるまで動き続けるので、プロセス終了時に閉じる
+    atexit.register(CloseTextListFiles)
+
+    def GetNextOutputPath(speaker_name: str) -> Path:
+        """ 話者のデータセットに次に保存する音声ファイルのパスを取得する (取得するたびに連番をインクリメントする) """
+
+        audio_output_dir = constants.DATASETS_DIR / speaker_name / 'audios'
+        audio_output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = audio_output_dir / f'{output_audio_count[speaker_name]:04}.wav'
+        output_audio_count[speaker_name] += 1  # 連番をインクリメント
+        return output_path
+
+    def SaveAudioToDataset(segment_audio_path: Path, output_path: Path) -> Path:
+        """ セグメントの音声ファイルをデータセットの音声ファイルとして保存する """
+
+        # Gradio のバージョンによっては WaveformOptions(sample_rate=44100) が反映されず、
+        # トリミング後の音声ファイルが 44.1kHz モノラル以外で書き出されることがあるので、その場合はサーバー側で変換してから保存する
+        ## それ以外の場合は、同一のファイルシステム上にあればコピーせずにハードリンクを作成する
+        segment_audio_info = soundfile.info(segment_audio_path)
+        if segment_audio_info.samplerate != 44100 or segment_audio_info.channels != 1:
+            import librosa
+            segment_audio, _ = librosa.load(segment_audio_path, sr=44100, mono=True)
+            soundfile.write(output_path, segment_audio, 44100, subtype='PCM_16')
+        else:
+            utils.LinkOrCopyFile(segment_audio_path, output_path)
+        return output_path
+
+    def SaveToDataset(segment_audio_path: Path, speaker_name: str, transcript: str) -> None:
+        """ セグメントの音声ファイルと書き起こし文を話者のデータセットに保存する """
+
+        # データセットに音声ファイルを保存 (書き起こし文はファイル名が長くなるので含まず、別途書き起こしファイルに保存する)
+        output_path = SaveAudioToDataset(segment_audio_path, GetNextOutputPath(speaker_name))
+        typer.echo(f'File {output_path} saved.')
+
+        # 音声ファイルのパスと書き起こし文のパスのペアを transcripts.list に順次追記
+        text_list_file = GetTextListFile(speaker_name)
+        text_list_file.write(f'{output_path.name}|{speaker_name}|JP|{transcript}\n')
+        typer.echo(f'File {text_list_file.name} updated.')
+        typer.echo('-' * utils.GetTerminalColumnSize())
 
     # --accept-all を指定して UI を表示せずにすべての音声ファイルを一括処理する場合
     if accept_all is True:
@@ -331,37 +605,42 @@ def create_datasets(
             sys.exit(1)
         speaker_name = speaker_name_list[0]
 
+        # 保存先の音声ファイルのパスと transcripts.list に追記する行を、セグメントの順に先にすべて決めておく
+        ## 連番は必ずセグメントの順に振られるので、この後で音声ファイルの保存を並列に行っても transcripts.list との対応は崩れない
+        save_jobs: list[tuple[Path, Path]] = []
+        text_list_lines: list[str] = []
+
         # 現在処理中の音声ファイルのインデックスが音声ファイルの総数に達するまでループ
         while current_index < len(segment_audio_paths):
 
             segment_audio_path = segment_audio_paths[current_index]
-            transcript = segment_audio_transcripts[current_index]
+            transcript = GetSegmentAudioTranscript(segment_audio_path)
             typer.echo(f'Segment File : {segment_audio_path.name}')
             typer.echo(f'Speaker Name : {speaker_name}')
             typer.echo(f'Transcript   : {transcript}')
-
-            # データセットに音声ファイルを保存 (書き起こし文はファイル名が長くなるので含まず、別途書き起こしファイルに保存する)
-            audio_output_dir = constants.DATASETS_DIR / speaker_name / 'audios'
-            audio_output_dir.mkdir(parents=True, exist_ok=True)
-            output_path = audio_output_dir / f'{output_audio_count[speaker_name]:04}.wav'
-            output_audio_count[speaker_name] += 1  # 連番をインクリメント
-            shutil.copyfile(segment_audio_path, output_path)
-            typer.echo(f'File {output_path} saved.')
-
-            # 音声ファイルのパスと書き起こし文のパスのペアを transcripts.list に順次追記
-            text_list_path = constants.DATASETS_DIR / speaker_name / 'transcripts.list'
-            if not text_list_path.exists():  # ファイルがなければ空のファイルを作成
-                text_list_path.parent.mkdir(parents=True, exist_ok=True)
-                text_list_path.touch()
-            with open(text_list_path, mode='a', encoding='utf-8') as f:
-                f.write(f'{output_path.name}|{speaker_name}|JP|{transcript}\n')
-            typer.echo(f'File {text_list_path} updated.')
             typer.echo('-' * utils.GetTerminalColumnSize())
 
+            # データセットに保存する音声ファイルのパス (書き起こし文はファイル名が長くなるので含まず、別途書き起こしファイルに保存する)
+            output_path = GetNextOutputPath(speaker_name)
+            save_jobs.append((segment_audio_path, output_path))
+            text_list_lines.append(f'{output_path.name}|{speaker_name}|JP|{transcript}\n')
+
             # 次の処理対象のファイルのインデックスに進める
             current_index += 1
 
+        # データセットに音声ファイルを保存する
+        ## 各セグメントの保存は互いに独立していて、処理の大半はディスク I/O 待ちなので、スレッドプールで並列に実行する
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for output_path in executor.map(lambda save_job: SaveAudioToDataset(*save_job), save_jobs):
+                typer.echo(f'File {output_path} saved.')
+
+        # 音声ファイルのパスと書き起こし文のパスのペアを transcripts.list にまとめて追記
+        text_list_file = GetTextListFile(speaker_name)
+        text_list_file.write(''.join(text_list_lines))
+        typer.echo(f'File {text_list_file.name} updated.')
+
         # すべての音声ファイルを処理したら終了
+        CloseTextListFiles()
         typer.echo('=' * utils.GetTerminalColumnSize())
         typer.echo('All files processed.')
         typer.echo('=' * utils.GetTerminalColumnSize())
@@ -375,7 +654,7 @@ def create_datasets(
     ) -> tuple[gradio.Audio, gradio.Dropdown, gradio.Textbox]:
         """ 確定ボタンが押されたときの処理 """
 
-        nonlocal current_index, segment_audio_paths, segment_audio_transcripts, choices, output_audio_count
+        nonlocal current_index, segment_audio_paths, choices, output_audio_count
 
         # 話者名が空の場合は初期画面から「確定」を押して実行されたイベントなので、保存処理は実行しない
         speaker_name = speaker_name.strip()
@@ -391,24 +670,9 @@ def create_datasets(
                 typer.echo('Segment file skipped.')
                 typer.echo('-' * utils.GetTerminalColumnSize())
             else:
-                # データセットに編集後の音声ファイルを保存 (書き起こし文はファイル名が長くなるので含まず、別途書き起こしファイルに保存する)
+                # データセットに編集後の音声ファイルと書き起こし文を保存
                 ## Gradio の謎機能で、GUI でトリムした編集後の一次ファイルが segment_audio_path_str として渡されてくる
-                audio_output_dir = constants.DATASETS_DIR / speaker_name / 'audios'
-                audio_output_dir.mkdir(parents=True, exist_ok=True)
-                output_path = audio_output_dir / f'{output_audio_count[speaker_name]:04}.wav'
-                output_audio_count[speaker_name] += 1  # 連番をインクリメント
-                shutil.copyfile(segment_audio_path, output_path)
-                typer.echo(f'File {output_path} saved.')
-
-                # 音声ファイルのパスと書き起こし文のパスのペアを transcripts.list に順次追記
-                text_list_path = constants.DATASETS_DIR / speaker_name / 'transcripts.list'
-                if not text_list_path.exists():  # ファイルがなければ空のファイルを作成
-                    text_list_path.parent.mkdir(parents=True, exist_ok=True)
-                    text_list_path.touch()
-                with open(text_list_path, mode='a', encoding='utf-8') as f:
-                    f.write(f'{output_path.name}|{speaker_name}|JP|{transcript}\n')
-                typer.echo(f'File {text_list_path} updated.')
-                typer.echo('-' * utils.GetTerminalColumnSize())
+                SaveToDataset(segment_audio_path, speaker_name, transcript)
 
             # 次の処理対象のファイルのインデックスに進める
             current_index += 1
@@ -449,13 +713,13 @@ def create_datasets(
                 waveform_options = WaveformOptions(sample_rate=44100),  # UI 上でトリミングした音声ファイルのサンプリングレート
             ),
             gradio.Dropdown(choices=choices, value=choices[0], label='音声セグメントの話者名'),  # type: ignore
-            gradio.Textbox(value=segment_audio_transcripts[current_index], label='音声セグメントの書き起こし文'),
+            gradio.Textbox(value=GetSegmentAudioTranscript(segment_audio_paths[current_index]), label='音声セグメントの書き起こし文'),
         )
 
     def OnReset(speaker_name: str) -> tuple[gradio.Audio, gradio.Textbox]:
         """ リセットボタンが押されたときの処理 """
 
-        nonlocal current_index, segment_audio_paths, segment_audio_transcripts, choices
+        nonlocal current_index, segment_audio_paths, choices
 
         # 話者名が空の場合は初期画面から「確定」を押して実行されたイベントなので、デフォルトのフォームを返す
         if speaker_name == '':
@@ -481,7 +745,7 @@ def create_datasets(
                 autoplay = True,
                 waveform_options = WaveformOptions(sample_rate=44100),  # UI 上でトリミングした音声ファイルのサンプリングレート
             ),
-            gradio.Textbox(value=segment_audio_transcripts[current_index], label='音声セグメントの書き起こし文'),
+            gradio.Textbox(value=GetSegmentAudioTranscript(segment_audio_paths[current_index]), label='音声セグメントの書き起こし文'),
         )
 
     # Gradio UI の定義と起動
@@ -550,6 +814,9 @@ def create_datasets(
 def check_dataset(
     speaker_name: Annotated[str, typer.Argument(help='Speaker name.')],
 ):
+    # librosa などに依存していてインポートが重い prepare モジュールは、利用するサブコマンドの中でインポートする
+    from Aivis import prepare
+
     typer.echo('=' * utils.GetTerminalColumnSize())
 
     # バリデーション
@@ -561,24 +828,29 @@ def check_dataset(
 
     # transcripts.list をパースして音声ファイル名と書き起こし文を取得
     ## 例: 0001.wav|SpeakerName|JP|こんにちは
-    with open(dataset_dir / 'transcripts.list', mode='r', encoding='utf-8') as f:
-        dataset_files_raw = f.read().splitlines()
-        dataset_files = [i.split('|') for i in dataset_files_raw]
+    dataset_files_raw = (dataset_dir / 'transcripts.list').read_text(encoding='utf-8').splitlines()
+    dataset_files = [i.split('|') for i in dataset_files_raw]
 
     typer.echo(f'Speaker: {speaker_name} / Directory: {dataset_dir}')
     typer.echo('=' * utils.GetTerminalColumnSize())
 
+    # データセットの音声ファイルの長さを並列に取得しておく
+    ## 1ファイルずつ順番に取得するとファイル数に比例して待たされるため、先にまとめて取得してから結果を順番に表示する
+    dataset_file_paths = [constants.DATASETS_DIR / speaker_name / 'audios' / dataset_file[0] for dataset_file in dataset_files]
+    existing_dataset_file_paths = [dataset_file_path for dataset_file_path in dataset_file_paths if dataset_file_path.exists()]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        audio_durations = dict(zip(existing_dataset_file_paths, executor.map(prepare.GetAudioFileDuration, existing_dataset_file_paths)))
+
     # 各音声ファイルごとにループ
     total_audio_duration = 0.0
-    for index, dataset_file in enumerate(dataset_files):
+    for index, (dataset_file, dataset_file_path) in enumerate(zip(dataset_files, dataset_file_paths)):
         if index > 0:
             typer.echo('-' * utils.GetTerminalColumnSize())
-        dataset_file_path = constants.DATASETS_DIR / speaker_name / 'audios' / dataset_file[0]
         typer.echo(f'Dataset File : {dataset_file_path}')
-        if not dataset_file_path.exists():
+        if dataset_file_path not in audio_durations:
             typer.echo(f'Error: Dataset file {dataset_file_path} not found.')
         else:
-            audio_duration = prepare.GetAudioFileDuration(dataset_file_path)
+            audio_duration = audio_durations[dataset_file_path]
             total_audio_duration += audio_duration
             typer.echo(f'Duration     : {utils.SecondToTimeCode(audio_duration)}')
             typer.echo(f'Transcript   : {dataset_file[3]}')
@@ -595,6 +867,8 @@ def train(
     batch_size: Annotated[int, typer.Option(help='Training batch size.')] = 4,
     epochs: Annotated[Union[int, None], typer.Option(help='Training epochs. (Cannot be used with --steps)')] = None,
     steps: Annotated[Union[int, None], typer.Option(help='Training steps. (Cannot be used with --epochs)')] = None,
+    parallel_preprocess: Annotated[bool, typer.Option(help='Run bert_gen.py and clap_gen.py in parallel. (Faster, but needs enough VRAM to hold both models at once)')] = False,
+    force_preprocess: Annotated[bool, typer.Option(help='Force preprocessing even if the dataset is unchanged since the last run.')] = False,
 ):
     typer.echo('=' * utils.GetTerminalColumnSize())
 
@@ -614,10 +888,9 @@ def train(
         sys.exit(1)
 
     # transcripts.list をパースしてデータセットの音声ファイルの総数を取得
-    with open(dataset_dir / 'transcripts.list', mode='r', encoding='utf-8') as f:
-        dataset_files_raw = f.read().splitlines()
-        dataset_files = [i.split('|') for i in dataset_files_raw]
-        dataset_files_count = len(dataset_files)
+    dataset_files_raw = (dataset_dir / 'transcripts.list').read_text(encoding='utf-8').splitlines()
+    dataset_files = [i.split('|') for i in dataset_files_raw]
+    dataset_files_count = len(dataset_files)
 
     # もし --epochs が指定されている場合、バッチサイズ・データセットの総数から自動的にステップ数を計算
     if epochs is not None:
@@ -638,57 +911,114 @@ def train(
     # 事前学習済みモデルがまだダウンロードされていなければダウンロード
     ## ダウンロード中に実行を中断するとダウンロード途中のロードできない事前学習済みモデルが残ってしまう
     ## 基本ダウンロード中に実行を中断すべきではないが、万が一そうなった場合は手動でダウンロード途中のモデルを削除してから再実行する必要がある
+    ## 各モデルは数百 MB あるため、まだダウンロードされていないモデルは並列にダウンロードする
     download_base_url = 'https://huggingface.co/Stardust-minus/Bert-VITS2-Japanese-Extra/resolve/main/'
-    if not (constants.CACHE_DIR / 'D_0.pth').exists():
-        typer.echo('Downloading pretrained model (D_0.pth) ...')
-        utils.DownloadFile(download_base_url + 'D_0.pth', constants.CACHE_DIR / 'D_0.pth')
-    if not (constants.CACHE_DIR / 'G_0.pth').exists():
-        typer.echo('Downloading pretrained model (G_0.pth) ...')
-        utils.DownloadFile(download_base_url + 'G_0.pth', constants.CACHE_DIR / 'G_0.pth')
-    if not (constants.CACHE_DIR / 'WD_0.pth').exists():
-        typer.echo('Downloading pretrained model (WD_0.pth) ...')
-        utils.DownloadFile(download_base_url + 'WD_0.pth', constants.CACHE_DIR / 'WD_0.pth')
-
-    # 既に Bert-VITS2/Data/(話者名)/audios/ が存在する場合は一旦削除
-    ## 同一のデータセットでもう一度学習を回す際、Bert 関連の中間ファイルを削除して再生成されるようにする
-    if (bert_vits2_dataset_dir / speaker_name / 'audios').exists():
-        shutil.rmtree(bert_vits2_dataset_dir / speaker_name / 'audios')
-    ## 再度空のディレクトリを作成
-    (bert_vits2_dataset_dir / speaker_name / 'audios').mkdir(parents=True, exist_ok=True)
-
-    # 既に Bert-VITS2/Data/(話者名)/filelists/ が存在する場合は一旦削除
-    ## 同一のデータセットでもう一度学習を回す際、書き起こしデータの中間ファイルを削除して再生成されるようにする
-    if (bert_vits2_dataset_dir / speaker_name / 'filelists').exists():
-        shutil.rmtree(bert_vits2_dataset_dir / speaker_name / 'filelists')
-    ## 再度空のディレクトリを作成
-    (bert_vits2_dataset_dir / speaker_name / 'filelists').mkdir(parents=True, exist_ok=True)
-
-    # 指定されたデータセットを Bert-VITS2 のデータセットディレクトリにコピー
-    ## ex: 04-Datasets/(話者名)/audios/ -> Bert-VITS2/Data/(話者名)/audios/wavs/
-    ## ex: 04-Datasets/(話者名)/transcripts.list -> Bert-VITS2/Data/(話者名)/filelists/transcripts.list
-    typer.echo('Copying dataset files...')
-    shutil.copytree(dataset_dir / 'audios', bert_vits2_dataset_dir / speaker_name / 'audios' / 'wavs')
-    shutil.copyfile(dataset_dir / 'transcripts.list', bert_vits2_dataset_dir / speaker_name / 'filelists' / 'transcripts.list')
-
-    # 書き起こし文ファイル内の音声ファイル名を Data/(話者名)/audios/wavs/ からのパスに変更
-    ## 例: 0001.wav|SpeakerName|JP|こんにちは → Data/SpeakerName/audios/wavs/0001.wav|SpeakerName|JP|こんにちは
-    with open(bert_vits2_dataset_dir / speaker_name / 'filelists' / 'transcripts.list', 'r', encoding='utf-8') as f:
-        transcripts_list = f.read()
-    with open(bert_vits2_dataset_dir / speaker_name / 'filelists' / 'transcripts.list', 'w', encoding='utf-8') as f:
-        f.write(re.sub(r'(.*\.wav)', f'Data/{speaker_name}/audios/wavs/\\1', transcripts_list))
+    download_jobs = [
+        (download_base_url + model_file_name, constants.CACHE_DIR / model_file_name)
+        for model_file_name in ('D_0.pth', 'G_0.pth', 'WD_0.pth')
+        if not (constants.CACHE_DIR / model_file_name).exists()
+    ]
+    if len(download_jobs) > 0:
+        typer.echo(f'Downloading pretrained models ({", ".join(path.name for _, path in download_jobs)}) ...')
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda download_job: utils.DownloadFile(*download_job), download_jobs))
+
+    # 前処理 (preprocess_text.py / bert_gen.py / clap_gen.py) の結果が最新かどうかを判定するためのキーを算出
+    ## データセットの transcripts.list と audios/ 内の各音声ファイルのファイル名・サイズ・更新日時から算出するので、データセットに手を加えるとキーが変わる
+    ## ディレクトリの更新日時はファイルの追加・削除でしか変わらず、同名の音声ファイルを書き換えた場合は変わらないため、各ファイルごとに見ている
+    ## 前回の学習からデータセットが変わっていなければ、数分以上かかることもある前処理をスキップできる
+    transcripts_list_stat = (dataset_dir / 'transcripts.list').stat()
+    preprocess_key_hash = hashlib.blake2b(
+        f'{speaker_name}:{transcripts_list_stat.st_mtime_ns}:{transcripts_list_stat.st_size}\n'.encode('utf-8'),
+    )
+    with os.scandir(dataset_dir / 'audios') as entries:
+        ## os.scandir() の列挙順は不定なので、ファイル名順に並べてからキーに含める
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            entry_stat = entry.stat()
+            preprocess_key_hash.update(f'{entry.name}:{entry_stat.st_size}:{entry_stat.st_mtime_ns}\n'.encode('utf-8'))
+    preprocess_key = preprocess_key_hash.hexdigest()
+
+    def GetPreprocessStampPath(stage: str) -> Path:
+        """ 前処理の各段階の完了を記録するスタンプファイルのパスを取得する """
+        return bert_vits2_dataset_dir / speaker_name / f'.stamp.{stage}'
+
+    def IsPreprocessFresh(stage: str) -> bool:
+        """ 前処理の段階の出力が現在のデータセットに対して最新かどうかを判定する """
+        if force_preprocess is True:
+            return False
+        try:
+            return GetPreprocessStampPath(stage).read_text(encoding='utf-8') == preprocess_key
+        except FileNotFoundError:
+            return False
+
+    def SavePreprocessStamp(stage: str) -> None:
+        """ 前処理の段階が完了したことをスタンプファイルに記録する """
+        GetPreprocessStampPath(stage).write_text(preprocess_key, encoding='utf-8')
+
+    preprocess_fresh = {stage: IsPreprocessFresh(stage) for stage in ('preprocess_text', 'bert_gen', 'clap_gen')}
+
+    # データセットが変わっている場合は、Bert-VITS2 のデータセットディレクトリを作り直す
+    ## bert_gen.py / clap_gen.py の出力は preprocess_text.py の出力に依存するので、この場合は全ての段階をやり直す
+    ## preprocess_text.py は config.json に話者の情報を書き込むため、config.json が存在しない場合もやり直す
+    ## 作り直しの途中で中断されても古いスタンプが残らないよう、先にスタンプファイルを削除しておく
+    if preprocess_fresh['preprocess_text'] is False or not (bert_vits2_dataset_dir / speaker_name / 'config.json').exists():
+        preprocess_fresh = {stage: False for stage in preprocess_fresh}
+        (bert_vits2_dataset_dir / speaker_name).mkdir(parents=True, exist_ok=True)
+        for stage in preprocess_fresh:
+            GetPreprocessStampPath(stage).unlink(missing_ok=True)
+
+        # 既に Bert-VITS2/Data/(話者名)/audios/ が存在する場合は一旦削除
+        ## 同一のデータセットでもう一度学習を回す際、Bert 関連の中間ファイルを削除して再生成されるようにする
+        if (bert_vits2_dataset_dir / speaker_name / 'audios').exists():
+            shutil.rmtree(bert_vits2_dataset_dir / speaker_name / 'audios')
+        ## 再度空のディレクトリを作成
+        (bert_vits2_dataset_dir / speaker_name / 'audios').mkdir(parents=True, exist_ok=True)
+
+        # 既に Bert-VITS2/Data/(話者名)/filelists/ が存在する場合は一旦削除
+        ## 同一のデータセットでもう一度学習を回す際、書き起こしデータの中間ファイルを削除して再生成されるようにする
+        if (bert_vits2_dataset_dir / speaker_name / 'filelists').exists():
+            shutil.rmtree(bert_vits2_dataset_dir / speaker_name / 'filelists')
+        ## 再度空のディレクトリを作成
+        (bert_vits2_dataset_dir / speaker_name / 'filelists').mkdir(parents=True, exist_ok=True)
+
+        # 指定されたデータセットを Bert-VITS2 のデータセットディレクトリにコピー
+        ## ex: 04-Datasets/(話者名)/audios/ -> Bert-VITS2/Data/(話者名)/audios/wavs/
+        ## ex: 04-Datasets/(話者名)/transcripts.list -> Bert-VITS2/Data/(話者名)/filelists/transcripts.list
+        ## 学習中に音声ファイル自体が書き換えられることはないため、音声ファイルはハードリンクとして配置し、データのコピーを省く
+        typer.echo('Copying dataset files...')
+        shutil.copytree(
+            dataset_dir / 'audios',
+            bert_vits2_dataset_dir / speaker_name / 'audios' / 'wavs',
+            copy_function = utils.LinkOrCopyFile,
+        )
+
+        # 書き起こし文ファイルをコピーしながら、ファイル内の音声ファイル名を Data/(話者名)/audios/wavs/ からのパスに変更
+        ## 例: 0001.wav|SpeakerName|JP|こんにちは → Data/SpeakerName/audios/wavs/0001.wav|SpeakerName|JP|こんにちは
+        ## 音声ファイル名は必ず行頭にあるので、正規表現は使わずに音声ファイル名を含む行の先頭にパスを付け足すだけでよい
+        ## 書き込み途中で中断されても壊れた書き起こし文ファイルが残らないよう、一時ファイルに書き込んでから置き換える
+        transcripts_list_path = bert_vits2_dataset_dir / speaker_name / 'filelists' / 'transcripts.list'
+        transcripts_list_tmp_path = transcripts_list_path.with_suffix('.list.tmp')
+        transcripts_list_prefix = f'Data/{speaker_name}/audios/wavs/'
+        with open(dataset_dir / 'transcripts.list', mode='r', encoding='utf-8') as src_file, \
+            open(transcripts_list_tmp_path, mode='w', encoding='utf-8') as dst_file:
+            dst_file.writelines(transcripts_list_prefix + line if '.wav' in line else line for line in src_file)
+        os.replace(transcripts_list_tmp_path, transcripts_list_path)
 
     # ダウンロードした事前学習済みモデルを Bert-VITS2/Data/(話者名)/models/ にコピー
     ## モデル学習の際にこれらのファイルは上書きされてしまうため、シンボリックリンクではなくコピーする
-    if not (bert_vits2_dataset_dir / speaker_name / 'models').exists():
+    ## ex: Bert-VITS2/Data/G_0.pth -> Bert-VITS2/Data/(話者名)/models/G_0.pth
+    ## 各モデルは数百 MB あるため、reflink が使える場合は reflink でコピーし、3 つのファイルのコピーを並列に実行する
+    models_dir = bert_vits2_dataset_dir / speaker_name / 'models'
+    models_dir.mkdir(parents=True, exist_ok=True)
+    copy_jobs = [
+        (constants.CACHE_DIR / model_file_name, models_dir / model_file_name)
+        for model_file_name in ('D_0.pth', 'G_0.pth', 'WD_0.pth')
+        if not (models_dir / model_file_name).exists()
+    ]
+    if len(copy_jobs) > 0:
         typer.echo('Copying pretrained model files...')
-        (bert_vits2_dataset_dir / speaker_name / 'models').mkdir(parents=True, exist_ok=True)
-        ## ex: Bert-VITS2/Data/G_0.pth -> Bert-VITS2/Data/(話者名)/models/G_0.pth
-        if not (bert_vits2_dataset_dir / speaker_name / 'models' / 'D_0.pth').exists():
-            shutil.copyfile(constants.CACHE_DIR / 'D_0.pth', bert_vits2_dataset_dir / speaker_name / 'models' / 'D_0.pth')
-        if not (bert_vits2_dataset_dir / speaker_name / 'models' / 'G_0.pth').exists():
-            shutil.copyfile(constants.CACHE_DIR / 'G_0.pth', bert_vits2_dataset_dir / speaker_name / 'models' / 'G_0.pth')
-        if not (bert_vits2_dataset_dir / speaker_name / 'models' / 'WD_0.pth').exists():
-            shutil.copyfile(constants.CACHE_DIR / 'WD_0.pth', bert_vits2_dataset_dir / speaker_name / 'models' / 'WD_0.pth')
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda copy_job: utils.CloneOrCopyFile(*copy_job), copy_jobs))
 
     # Bert-VITS2/configs/config.json を Bert-VITS2/Data/(話者名)/config.json にコピー
     ## モデル学習の際にこれらのファイルは上書きされてしまうため、シンボリックリンクではなくコピーする
@@ -697,63 +1027,83 @@ def train(
         shutil.copyfile(constants.BERT_VITS2_DIR / 'configs' / 'config.json', bert_vits2_dataset_dir / speaker_name / 'config.json')
 
     # コピーした config.json の epochs と batch_size とを指定された値に変更
-    with open(bert_vits2_dataset_dir / speaker_name / 'config.json', mode='r', encoding='utf-8') as f:
-        config = json.load(f)
+    config = utils.LoadJSONFile(bert_vits2_dataset_dir / speaker_name / 'config.json')
     config['train']['epochs'] = epochs
     config['train']['batch_size'] = batch_size
-    with open(bert_vits2_dataset_dir / speaker_name / 'config.json', mode='w', encoding='utf-8') as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    utils.SaveJSONFile(bert_vits2_dataset_dir / speaker_name / 'config.json', config)
 
     # Bert-VITS2/default_config.yml を Bert-VITS2/config.yml にコピー
     ## 学習対象のデータセット名を変更する必要があるため、既に config.yml が存在する場合も上書きする
+    ## コピーしてから読み直すのではなく、default_config.yml を読み込んで書き換えた内容を直接 config.yml に書き込む
+    ## config.yml 内の dataset_path: "Data/MySpeaker" を dataset_path: "Data/(話者名)" に正規表現で置換する
     typer.echo('Copying default_config.yml to config.yml...')
-    shutil.copyfile(constants.BERT_VITS2_DIR / 'default_config.yml', constants.BERT_VITS2_DIR / 'config.yml')
-
-    # config.yml 内の dataset_path: "Data/MySpeaker" を dataset_path: "Data/(話者名)" に変更
-    ## 正規表現で置換する
-    with open(constants.BERT_VITS2_DIR / 'config.yml', mode='r', encoding='utf-8') as f:
-        config_yml = f.read()
-    config_yml = re.sub(r'dataset_path: "Data/.*"', f'dataset_path: "Data/{speaker_name}"', config_yml)
-    with open(constants.BERT_VITS2_DIR / 'config.yml', mode='w', encoding='utf-8') as f:
-        f.write(config_yml)
+    config_yml = (constants.BERT_VITS2_DIR / 'default_config.yml').read_text(encoding='utf-8')
+    config_yml = TRAIN_DATASET_PATH_PATTERN.sub(f'dataset_path: "Data/{speaker_name}"', config_yml)
+    utils.SaveTextFile(constants.BERT_VITS2_DIR / 'config.yml', config_yml)
     typer.echo('=' * utils.GetTerminalColumnSize())
 
     # Bert-VITS2/preprocess_text.py を実行
-    typer.echo('Running preprocess_text.py...')
-    typer.echo('-' * utils.GetTerminalColumnSize())
-    subprocess.run(
-        ['python', constants.BERT_VITS2_DIR / 'preprocess_text.py'],
-        cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
-        check = True,
-    )
-    typer.echo('=' * utils.GetTerminalColumnSize())
-
-    # Bert-VITS2/bert_gen.py を実行
-    typer.echo('Running bert_gen.py...')
-    typer.echo('-' * utils.GetTerminalColumnSize())
-    subprocess.run(
-        ['python', constants.BERT_VITS2_DIR / 'bert_gen.py'],
-        cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
-        check = True,
-    )
+    if preprocess_fresh['preprocess_text'] is True:
+        typer.echo('Skipping preprocess_text.py (dataset is unchanged since the last run).')
+    else:
+        typer.echo('Running preprocess_text.py...')
+        typer.echo('-' * utils.GetTerminalColumnSize())
+        subprocess.run(
+            [sys.executable, constants.BERT_VITS2_DIR / 'preprocess_text.py'],
+            cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
+            check = True,
+        )
+        SavePreprocessStamp('preprocess_text')
     typer.echo('=' * utils.GetTerminalColumnSize())
 
-    # Bert-VITS2/clap_gen.py を実行
-    typer.echo('Running clap_gen.py...')
-    typer.echo('-' * utils.GetTerminalColumnSize())
-    subprocess.run(
-        ['python', constants.BERT_VITS2_DIR / 'clap_gen.py'],
-        cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
-        check = True,
-    )
-    typer.echo('=' * utils.GetTerminalColumnSize())
+    # Bert-VITS2/bert_gen.py と Bert-VITS2/clap_gen.py を実行
+    ## どちらも preprocess_text.py が生成した書き起こし文ファイルを読み込み、それぞれ独立した特徴量ファイルを書き出すだけなので、
+    ## 同時に実行しても互いに干渉しない (学習はこの両方の特徴量ファイルが揃ってから開始する)
+    ## ただし並列に実行すると両方のモデルが同時に VRAM に載るため、VRAM が少ない環境ではメモリ不足になる可能性がある
+    ## このため既定では順番に実行し、--parallel-preprocess が指定されたときのみ並列に実行する
+    ## 前回の実行で既に完了している段階はスキップする
+    pending_stages = [stage for stage in ('bert_gen', 'clap_gen') if preprocess_fresh[stage] is False]
+    if len(pending_stages) == 0:
+        typer.echo('Skipping bert_gen.py and clap_gen.py (dataset is unchanged since the last run).')
+        typer.echo('=' * utils.GetTerminalColumnSize())
+    elif parallel_preprocess is True and len(pending_stages) > 1:
+        typer.echo('Running bert_gen.py and clap_gen.py in parallel...')
+        typer.echo('-' * utils.GetTerminalColumnSize())
+        processes: list[subprocess.Popen[bytes]] = [
+            subprocess.Popen(
+                [sys.executable, constants.BERT_VITS2_DIR / f'{stage}.py'],
+                cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
+            )
+            for stage in pending_stages
+        ]
+        return_codes = [process.wait() for process in processes]
+        ## 片方だけが失敗した場合も、成功した方は次回の実行でスキップできるようにスタンプを記録しておく
+        for stage, return_code in zip(pending_stages, return_codes):
+            if return_code == 0:
+                SavePreprocessStamp(stage)
+        ## 失敗した場合は、順番に実行する場合 (check=True) と同じく CalledProcessError を送出する
+        for process, return_code in zip(processes, return_codes):
+            if return_code != 0:
+                raise subprocess.CalledProcessError(return_code, process.args)
+        typer.echo('=' * utils.GetTerminalColumnSize())
+    else:
+        for stage in pending_stages:
+            typer.echo(f'Running {stage}.py...')
+            typer.echo('-' * utils.GetTerminalColumnSize())
+            subprocess.run(
+                [sys.executable, constants.BERT_VITS2_DIR / f'{stage}.py'],
+                cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
+                check = True,
+            )
+            SavePreprocessStamp(stage)
+            typer.echo('=' * utils.GetTerminalColumnSize())
 
     # 学習を開始 (Bert-VITS2/train_ms.py を実行)
     typer.echo('Training started.')
     typer.echo('-' * utils.GetTerminalColumnSize())
     try:
         subprocess.run(
-            ['python', constants.BERT_VITS2_DIR / 'train_ms.py'],
+            [sys.executable, constants.BERT_VITS2_DIR / 'train_ms.py'],
             cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
             check = True,
         )
@@ -786,17 +1136,26 @@ def infer(
     ## モデルは 1000 ステップごとに保存されており、G_(ステップ数).pth のファイル名フォーマットで保存されている
     ## 例: G_0.pth / G_1000.pth / G_2000.pth / G_3000.pth
     if model_step is None:
-        model_step = 0
-        for model_file in (model_dir / 'models').glob('G_*.pth'):
-            step = int(re.sub(r'\D', '', model_file.stem))
-            if step > model_step:
-                model_step = step
-        if (model_dir / 'models' / f'G_{model_step}.pth').exists():
-            model_file = model_dir / 'models' / f'G_{model_step}.pth'
-        else:
-            typer.echo(f'Error: Model file {model_dir / "models" / f"G_{model_step}.pth"} not found.')
+        ## ファイル名は G_(ステップ数).pth の形式なので、正規表現は使わずに文字列のスライスでステップ数を取り出す
+        ## 走査で見つかったファイルは存在が確定しているので、改めて存在確認をする必要はない
+        ## まだ一度も学習していない話者では models/ ディレクトリ自体が存在しないので、その場合は候補なしとして扱う
+        model_candidates: list[tuple[int, Path]] = []
+        try:
+            with os.scandir(model_dir / 'models') as entries:
+                for entry in entries:
+                    if not (entry.name.startswith('G_') and entry.name.endswith('.pth')):
+                        continue
+                    try:
+                        model_candidates.append((int(entry.name[2:-4]), Path(entry.path)))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        if len(model_candidates) == 0:
+            typer.echo(f'Error: Model file {model_dir / "models" / "G_*.pth"} not found.')
             typer.echo('=' * utils.GetTerminalColumnSize())
             sys.exit(1)
+        model_step, model_file = max(model_candidates)
 
     # ステップ数が指定されている場合はそのステップのモデルを探す
     else:
@@ -813,18 +1172,18 @@ def infer(
     # config.yml を正規表現で書き換える
     ## dataset_path: ".*" を dataset_path: "Data/(話者名)" に書き換える
     ## model: "models/.*" を model: "models/G_(ステップ数).pth" に書き換える
-    with open(constants.BERT_VITS2_DIR / 'config.yml', mode='r', encoding='utf-8') as f:
-        config_yml = f.read()
-    config_yml = re.sub(r'dataset_path: ".*"', f'dataset_path: "Data/{speaker_name}"', config_yml)
-    config_yml = re.sub(r'model: "models/.*"', f'model: "models/G_{model_step}.pth"', config_yml)
-    with open(constants.BERT_VITS2_DIR / 'config.yml', mode='w', encoding='utf-8') as f:
-        f.write(config_yml)
+    config_yml = (constants.BERT_VITS2_DIR / 'config.yml').read_text(encoding='utf-8')
+    config_yml = INFER_CONFIG_PATTERN.sub(
+        lambda match: f'dataset_path: "Data/{speaker_name}"' if match.lastgroup == 'dataset_path' else f'model: "models/G_{model_step}.pth"',
+        config_yml,
+    )
+    utils.SaveTextFile(constants.BERT_VITS2_DIR / 'config.yml', config_yml)
 
     # Bert-VITS2/webui.py を実行
     typer.echo('Running Infer Web UI...')
     typer.echo('-' * utils.GetTerminalColumnSize())
     subprocess.run(
-        ['python', constants.BERT_VITS2_DIR / 'webui.py'],
+        [sys.executable, constants.BERT_VITS2_DIR / 'webui.py'],
         cwd = constants.BERT_VITS2_DIR,  # カレントディレクトリを Bert-VITS2/ に変更しないと実行できない
         check = True,
     )
@@ -837,4 +1196,5 @@ def version():
 
 
 if __name__ == '__main__':
+    utils.InstallTerminalResizeHandler()
     app()
@@ -14,7 +14,8 @@ BERT_VITS2_DIR = BASE_DIR / 'Bert-VITS2'
 
 # データソースとして読み込むファイルの拡張子
 ## 大半の動画・音声ファイルを網羅しているはず
-SOURCE_FILE_EXTENSIONS = [
+## ファイルごとに拡張子が含まれるかを判定するため、frozenset で定義している
+SOURCE_FILE_EXTENSIONS = frozenset([
     '.wav',
     '.flac',
     '.opus',
@@ -32,7 +33,7 @@ SOURCE_FILE_EXTENSIONS = [
     '.m2ts',
     '.mpg',
     '.mpeg',
-]
+])
 
 # スキップする Whisper のハルシネーション避けのワード
 SKIP_TRANSCRIPTS = [
@@ -51,3 +52,15 @@ class ModelNameType(str, Enum):
     large_v1 = 'large-v1'
     large_v2 = 'large-v2'
     large_v3 = 'large-v3'
+    # large-v3 を日本語向けに蒸留した kotoba-whisper (CTranslate2 形式)
+    ## エンコーダーは large-v3 と同じだが、デコーダーが 2 層しかないため書き起こしが大幅に高速になる
+    ## distil-whisper の公式モデルは英語専用なので、日本語の書き起こしには使えない
+    kotoba_whisper_v1_0 = 'kotoba-tech/kotoba-whisper-v1.0-faster'
+
+class ComputeType(str, Enum):
+    auto = 'auto'
+    int8 = 'int8'
+    int8_float16 = 'int8_float16'
+    int8_float32 = 'int8_float32'
+    float16 = 'float16'
+    float32 = 'float32'
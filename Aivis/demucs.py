@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import ffmpeg
+import multiprocessing
 import numpy as np
 import typer
 from concurrent.futures import ProcessPoolExecutor
@@ -37,7 +38,7 @@ def ConvertToWave(file_paths: list[Path], output_dir: Path) -> list[Path]:
 
         # 出力先のファイルがすでに存在する場合
         # すでに変換済みなのでスキップ
-        output_file_path = output_dir / f'{file_path.name.split(".")[0]}.wav'
+        output_file_path = output_dir / f'{file_path.stem}.wav'
         if output_file_path.exists():
             typer.echo(f'File {file_path} is already converted.')
             output_file_paths.append(output_file_path)
@@ -72,31 +73,64 @@ def ExtractVoices(file_paths: list[Path], output_dir: Path) -> list[Path]:
         list[Path]: 出力されたファイルパスのリスト
     """
 
+    import torch
+
     # Demucs での推論終了時に確実に VRAM を解放するため、マルチプロセスで実行する
     ## 確実に VRAM を解放できないと VRAM 容量次第では後続の Whisper での書き起こし処理に支障するため
-    ## 並列処理は行っていない (リソース的に厳しい) ため本来はマルチプロセスにする意味はないが、
     ## マルチプロセスで起動させれば、マルチプロセス終了時に確実に VRAM を解放することができる
     ## del model でもある程度解放できるが、完全に解放されるわけではないみたい…
-    ## 並列処理を行うためにマルチプロセスにしているわけではないため max_workers は 1 に設定している
-    with ProcessPoolExecutor(max_workers=1) as executor:
-        return executor.submit(__ExtractVoicesMultiProcess, file_paths, output_dir).result()
+    # GPU が複数ある場合は、GPU ごとにプロセスを起動し、ファイルを GPU の数で振り分けて並列に音源分離を行う
+    ## 1 つの GPU で複数のプロセスを動かすとリソース的に厳しいので、GPU 1 つにつき 1 プロセスまでにしている
+    num_gpus = max(torch.cuda.device_count(), 1)
+    num_workers = min(num_gpus, max(len(file_paths), 1))
+
+    # 親プロセスではすでに PyTorch がインポートされており CUDA の状態を引き継ぐと問題が起きるため、fork ではなく spawn でプロセスを起動する
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(__ExtractVoicesMultiProcess, file_paths[worker_index::num_workers], output_dir, f'cuda:{worker_index}')
+            for worker_index in range(num_workers)
+        ]
+
+        # 各プロセスの結果を元のファイルの順序に並べ直す
+        output_file_paths: list[Path] = [Path()] * len(file_paths)
+        for worker_index, future in enumerate(futures):
+            output_file_paths[worker_index::num_workers] = future.result()
+
+    return output_file_paths
 
 
-def __ExtractVoicesMultiProcess(file_paths: list[Path], output_dir: Path) -> list[Path]:
+def __ExtractVoicesMultiProcess(file_paths: list[Path], output_dir: Path, device: str) -> list[Path]:
     """
     ProcessPoolExecutor で実行される ExtractVoices() の実処理
 
     Args:
         file_paths (list[Path]): ファイルパスのリスト
         output_dir (Path): 出力先のフォルダ
+        device (str): 音源分離に使うデバイス (例: cuda:0)
 
     Returns:
         list[Path]: 出力されたファイルパスのリスト
     """
 
+    # spawn で起動されたワーカープロセスでは Aivis/__main__.py 冒頭の警告の抑制が実行されないため、ここでも同じ設定を行う
+    ## torch や Demucs のインポート時に出る警告を抑制するため、インポートより前に設定する
+    import warnings
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    warnings.simplefilter(action='ignore', category=RuntimeWarning)
+    warnings.simplefilter(action='ignore', category=UserWarning)
+
     import torch
     from demucs.pretrained import get_model_from_args
 
+    # 以降の CUDA の処理 (VRAM の解放など) が、このプロセスに割り当てられた GPU に対して行われるようにする
+    torch.cuda.set_device(device)
+
+    # Demucs は split=True で常に同じ長さのチャンクに分割して推論するため、cuDNN に最適な畳み込みアルゴリズムを選ばせる
+    torch.backends.cudnn.benchmark = True
+    # Ampere 以降の GPU では、Demucs の Transformer 層の行列演算を TF32 で実行する
+    ## 畳み込み層は PyTorch のデフォルトで既に TF32 が有効になっている
+    torch.backends.cuda.matmul.allow_tf32 = True
+
     demucs_model = None
 
     # 出力されたファイルパスのリスト (すでに抽出済みのファイルも含む)
@@ -108,7 +142,7 @@ def __ExtractVoicesMultiProcess(file_paths: list[Path], output_dir: Path) -> lis
 
         # 出力先のファイルがすでに存在する場合
         # すでに抽出済みなのでスキップ
-        output_file_path = output_dir / f'{file_path.name.split(".")[0]}.wav'
+        output_file_path = output_dir / f'{file_path.stem}.wav'
         if output_file_path.exists():
             typer.echo(f'File {file_path} is already separated.')
             output_file_paths.append(output_file_path)
@@ -129,7 +163,7 @@ def __ExtractVoicesMultiProcess(file_paths: list[Path], output_dir: Path) -> lis
             demucs_model,
             str(file_path),
             save_path = str(output_file_path),
-            device = 'cuda',
+            device = device,
             verbose = True,
         )
         typer.echo('-' * utils.GetTerminalColumnSize())
@@ -229,7 +263,9 @@ def RunDemucs(
         progress=verbose is not None,
     )
     apply_kwarg.update(demucs_options)
-    vocals = apply_model(**apply_kwarg)[0, vocals_idx].mean(0)  # type: ignore
+    ## 推論のみで勾配は不要なので、autograd のメタデータを一切記録しない inference_mode で実行する
+    with torch.inference_mode():
+        vocals = apply_model(**apply_kwarg)[0, vocals_idx].mean(0)  # type: ignore
 
     if device != 'cpu':
         torch.cuda.empty_cache()
@@ -1,15 +1,17 @@
 
 import errno
+import functools
 import librosa
+import numpy as np
+import os
 import pyloudnorm
 import re
 import regex
-import shutil
 import soundfile
 import subprocess
 import sys
-import tempfile
 import typer
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydub import AudioSegment
 
@@ -25,82 +27,121 @@ def GetAudioFileDuration(file_path: Path) -> float:
         float: 音声ファイルの長さ (秒)
     """
 
-    # 音声ファイルを読み込む
-    audio = AudioSegment.from_file(file_path)
+    # WAV などの libsndfile が対応している形式であれば、ヘッダーから音声ファイルの長さを取得する
+    ## 音声ファイル全体をデコードする必要がないため、FFmpeg を起動するよりも圧倒的に高速
+    try:
+        return soundfile.info(str(file_path)).duration
+    except RuntimeError:
+        pass
 
-    # 音声ファイルの長さを取得する
+    # libsndfile が対応していない形式の場合は、pydub (FFmpeg) で音声ファイルを読み込んで長さを取得する
+    audio = AudioSegment.from_file(file_path)
     return audio.duration_seconds
 
 
-def SliceAudioFile(src_file_path: Path, dst_file_path: Path, start: float, end: float, trim_silence: bool) -> Path:
+def LoadAudioFile(file_path: Path, sample_rate: int = 44100) -> np.ndarray:
+    """
+    音声ファイルを FFmpeg でデコードし、モノラルの音声データとして読み込む
+    切り出し後の音声ファイルは 16bit で出力されるため、メモリ使用量を抑えるべく int16 のまま保持する
+
+    Args:
+        file_path (Path): 音声ファイルのパス
+        sample_rate (int): 読み込む音声データのサンプリングレート. Defaults to 44100.
+
+    Returns:
+        np.ndarray: モノラルの音声データ (int16)
+    """
+
+    # FFmpeg で指定されたサンプリングレートの 16bit モノラルの PCM に変換し、標準出力から読み込む
+    ## 音声チャンネルはここでモノラルにダウンミックスする
+    result = subprocess.run([
+        'ffmpeg',
+        '-nostdin',
+        '-i', str(file_path),
+        '-f', 's16le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-acodec', 'pcm_s16le',
+        '-',
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def SliceAudioFiles(audio: np.ndarray, sample_rate: int, slices: list[tuple[Path, float, float]], trim_silence: bool) -> list[Path]:
     """
-    音声ファイルの一部を切り出して出力する
+    デコード済みの音声データから複数の区間を切り出して出力する
+    セグメントごとに音声ファイルをデコードし直すと、セグメント数分だけ FFmpeg の起動とデコードが発生してしまうため、
+    切り出し元の音声ファイルは LoadAudioFile() で事前に1回だけデコードしておく
     trim_silence=True のときは追加で切り出した音声ファイルの前後の無音区間が削除される
+    各区間の切り出しは互いに独立しているため、スレッドプールで並列に実行する
 
     Args:
-        src_file_path (Path): 切り出し元の音声ファイルのパス
+        audio (np.ndarray): 切り出し元のモノラルの音声データ (int16 または float32)
+        sample_rate (int): 切り出し元の音声データのサンプリングレート
+        slices (list[tuple[Path, float, float]]): 切り出し先の音声ファイルのパス・切り出し開始時間 (秒)・切り出し終了時間 (秒) のリスト
+        trim_silence (bool): 前後の無音区間を削除するかどうか
+
+    Returns:
+        list[Path]: 実際に出力された音声ファイルのパスのリスト
+    """
+
+    # ラウドネス正規化・無音区間の削除・WAV の書き込みは NumPy や libsndfile 側で GIL を解放して実行される部分が大半なので、
+    # 切り出し元の巨大な音声データを各プロセスにコピーするマルチプロセスよりも、データを共有できるマルチスレッドの方が効率が良い
+    ## executor.map() は入力と同じ順序で結果を返すため、戻り値の順序は slices の順序と一致する
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(
+            lambda slice_range: __SliceAudio(audio, sample_rate, *slice_range, trim_silence),
+            slices,
+        ))
+
+
+def __SliceAudio(audio: np.ndarray, sample_rate: int, dst_file_path: Path, start: float, end: float, trim_silence: bool) -> Path:
+    """
+    SliceAudioFiles() で実行される、デコード済みの音声データからの切り出し処理
+
+    Args:
+        audio (np.ndarray): 切り出し元の音声データ
+        sample_rate (int): 切り出し元の音声データのサンプリングレート
         dst_file_path (Path): 切り出し先の音声ファイルのパス
         start (float): 切り出し開始時間 (秒)
         end (float): 切り出し終了時間 (秒)
         trim_silence (bool): 前後の無音区間を削除するかどうか
-    """
 
-    # 一時保存先のテンポラリファイル
-    ## Windows だと /tmp/ が使えないので NamedTemporaryFile を使う
-    ## src_file_path --切り出し--> temp1 --モノラル化--> temp2 --ノーマライズ--> temp3 --無音区間削除--> temp4 --リネーム--> dst_file_path
-    dst_file_path_temp1 = Path(tempfile.NamedTemporaryFile(suffix='.wav').name)
-    dst_file_path_temp2 = Path(tempfile.NamedTemporaryFile(suffix='.wav').name)
-    dst_file_path_temp3 = Path(tempfile.NamedTemporaryFile(suffix='.wav').name)
-    dst_file_path_temp4 = Path(tempfile.NamedTemporaryFile(suffix='.wav').name)
+    Returns:
+        Path: 実際に出力された音声ファイルのパス
+    """
 
     # 開始時刻ちょうどから切り出すと子音が切れてしまうことがあるため、開始時刻の 0.1 秒前から切り出す
     start = max(0, start - 0.1)
 
-    # 音声ファイルを読み込む
-    audio = AudioSegment.from_file(src_file_path)
-
-    # 音声ファイルを切り出す
-    sliced_audio = audio[start * 1000:end * 1000]
-    sliced_audio.export(dst_file_path_temp1, format='wav')
+    # 音声データを切り出す
+    sliced_audio = audio[int(start * sample_rate):int(end * sample_rate)]
 
-    # FFmpeg で 44.1kHz 16bit モノラルの wav 形式に変換する
-    ## 基本この時点で 44.1kHz 16bit にはなっているはずだが、音声チャンネルはステレオのままなので、ここでモノラルにダウンミックスする
-    subprocess.run([
-        'ffmpeg',
-        '-y',
-        '-i', str(dst_file_path_temp1),
-        '-ac', '1',
-        '-ar', '44100',
-        '-acodec', 'pcm_s16le',
-        str(dst_file_path_temp2),
-    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # 16bit の音声データの場合は、切り出した部分だけを -1.0 ~ 1.0 の float32 に変換する
+    ## 切り出し元の音声データ全体を変換するとメモリ使用量が倍になるため、切り出した後に変換している
+    if sliced_audio.dtype == np.int16:
+        sliced_audio = sliced_audio.astype(np.float32) / 32768.0
 
-    # pyloudnorm で音声ファイルをノーマライズ（ラウドネス正規化）する
-    ## FFmpeg でのモノラルへのダウンミックスで音量が変わる可能性も無くはないため、念のためダウンミックス後にノーマライズを行うように実装している
-    LoudnessNorm(dst_file_path_temp2, dst_file_path_temp3, loudness=-23.0)  # -23LUFS にノーマライズする
+    # pyloudnorm で音声データをノーマライズ（ラウドネス正規化）する
+    sliced_audio = LoudnessNorm(sliced_audio, sample_rate, loudness=-23.0)  # -23LUFS にノーマライズする
 
     if trim_silence is True:
         # 最後に前後の無音区間を librosa を使って削除する
-        ## sr=None を指定して、音声ファイルのサンプリングレートをそのまま維持して読み込む (指定しないと 22050Hz になる…)
         ## 無音区間は dB 基準なのでノーマライズ後に実行した方が望ましい
-        y, sr = librosa.load(dst_file_path_temp3, sr=None)  # type: ignore
-        y, _ = librosa.effects.trim(y, top_db=30)
-        soundfile.write(dst_file_path_temp4, y, sr)
-    else:
-        # 無音区間は削除せずにそのままコピーする
-        shutil.copyfile(dst_file_path_temp3, dst_file_path_temp4)
+        sliced_audio, _ = librosa.effects.trim(sliced_audio, top_db=30)
 
-    # 最後にファイルを dst_file_path にコピーする
+    # 44.1kHz 16bit モノラルの wav 形式で dst_file_path に出力する
     try:
-        shutil.copyfile(dst_file_path_temp4, dst_file_path)
+        __WriteWaveFile(dst_file_path, sliced_audio, sample_rate)
     except OSError as ex:
         # 万が一ファイル名が最大文字数を超える場合は、ファイル名を短くする
         ## 87文字は、Linux のファイル名の最大バイト数 (255B) から、拡張子 (.wav) を引いた 251B に入る UTF-8 の最大文字数
         ## NTFS のファイル名の最大文字数は 255 文字なので (バイト単位ではない) 、Windows でも問題ないはず
         if ex.errno == errno.ENAMETOOLONG:
-            # ファイル名を短くした上でコピーする
+            # ファイル名を短くした上で出力する
             dst_file_path_new = dst_file_path.with_name(dst_file_path.stem[:87] + dst_file_path.suffix)
-            shutil.copyfile(dst_file_path_temp4, dst_file_path_new)
+            __WriteWaveFile(dst_file_path_new, sliced_audio, sample_rate)
             typer.echo('Warning: File name is too long. Truncated.')
             # フルの書き起こし文にアクセスできるように、別途テキストファイルに書き起こし文を保存する
             with open(dst_file_path_new.with_suffix('.txt'), mode='w', encoding='utf-8') as f:
@@ -113,7 +154,7 @@ def SliceAudioFile(src_file_path: Path, dst_file_path: Path, start: float, end:
         elif ex.errno == errno.EINVAL and sys.platform == 'win32':
             # ファイル名に使用できない文字を置換する
             dst_file_path_new = dst_file_path.with_name(re.sub(r'[\\/:*?"<>|]', '_', dst_file_path.stem) + dst_file_path.suffix)
-            shutil.copyfile(dst_file_path_temp4, dst_file_path_new)
+            __WriteWaveFile(dst_file_path_new, sliced_audio, sample_rate)
             typer.echo('Warning: File name contains invalid characters. Replaced.')
             # フルの書き起こし文にアクセスできるように、別途テキストファイルに書き起こし文を保存する
             with open(dst_file_path_new.with_suffix('.txt'), mode='w', encoding='utf-8') as f:
@@ -124,23 +165,32 @@ def SliceAudioFile(src_file_path: Path, dst_file_path: Path, start: float, end:
         else:
             raise ex
 
-    # 一時ファイルを削除
-    dst_file_path_temp1.unlink()
-    dst_file_path_temp2.unlink()
-    dst_file_path_temp3.unlink()
-    dst_file_path_temp4.unlink()
-
     return dst_file_path
 
 
-def LoudnessNorm(input: Path, output: Path, peak: float = -1.0, loudness: float = -23.0, block_size : float = 0.400) -> None:
+def __WriteWaveFile(file_path: Path, audio: np.ndarray, sample_rate: int) -> None:
+    """
+    音声データを 16bit の wav 形式で出力する
+    ファイル名に起因するエラーを OSError として受け取れるように、ファイルは Python 側で開く
+
+    Args:
+        file_path (Path): 出力先の音声ファイルのパス
+        audio (np.ndarray): 音声データ
+        sample_rate (int): 音声データのサンプリングレート
     """
-    音声ファイルに対して、ラウドネス正規化（ITU-R BS.1770-4）を実行する
+
+    with open(file_path, mode='wb') as f:
+        soundfile.write(f, audio, sample_rate, format='WAV', subtype='PCM_16')
+
+
+def LoudnessNorm(audio: np.ndarray, rate: int, peak: float = -1.0, loudness: float = -23.0, block_size : float = 0.400) -> np.ndarray:
+    """
+    音声データに対して、ラウドネス正規化（ITU-R BS.1770-4）を実行する
     ref: https://github.com/fishaudio/audio-preprocess/blob/main/fish_audio_preprocess/utils/loudness_norm.py#L9-L33
 
     Args:
-        input: 入力音声ファイル
-        output: 出力音声ファイル
+        audio: 入力音声データ
+        rate: 入力音声データのサンプリングレート
         peak: 音声を N dB にピーク正規化する. Defaults to -1.0.
         loudness: 音声を N dB LUFS にラウドネス正規化する. Defaults to -23.0.
         block_size: ラウドネス測定用のブロックサイズ. Defaults to 0.400. (400 ms)
@@ -149,9 +199,6 @@ def LoudnessNorm(input: Path, output: Path, peak: float = -1.0, loudness: float
         ラウドネス正規化された音声データ
     """
 
-    # 音声ファイルを読み込む
-    audio, rate = soundfile.read(str(input))
-
     # ノーマライズを実行
     audio = pyloudnorm.normalize.peak(audio, peak)
     meter = pyloudnorm.Meter(rate, block_size=block_size)  # create BS.1770 meter
@@ -161,14 +208,29 @@ def LoudnessNorm(input: Path, output: Path, peak: float = -1.0, loudness: float
     except ValueError:
         pass
 
-    # 音声ファイルを出力する
-    soundfile.write(str(output), audio, rate)
+    return audio
+
+
+# PrepareText() で使う正規表現
+## セグメントごとに呼び出されるため、モジュールの読み込み時に一度だけコンパイルしておく
+HIRAGANA_KATAKANA_KANJI_PATTERN = regex.compile(r'\p{Hiragana}|\p{Katakana}|\p{Han}')
+LEADING_PUNCTUATION_JA_PATTERN = re.compile(r'^[、。！？]+')
+LEADING_PUNCTUATION_EN_PATTERN = re.compile(r'^[,.!?]+')
+REPEATED_CHARACTER_PATTERN = re.compile(r'(.)\1{3,}')
+SPACE_PATTERN = re.compile(r'[ 　]')
+ROUND_BRACKETS_PATTERN = re.compile(r'（.*?）')
+LENTICULAR_BRACKETS_PATTERN = re.compile(r'【.*?】')
+CORNER_BRACKETS_PATTERN = re.compile(r'「.*?」')
+REPEATED_PUNCTUATION_JA_PATTERN = re.compile(r'([、。！？])\1+')
+REPEATED_PUNCTUATION_EN_PATTERN = re.compile(r'([,\.!\?])\1+')
 
 
+@functools.lru_cache(maxsize=4096)
 def PrepareText(text: str) -> str:
     """
     Whisper で書き起こされたテキストをより適切な形に前処理する
     (Whisper の書き起こし結果にはガチャがあり、句読点が付く場合と付かない場合があるため、前処理が必要)
+    Whisper は同じハルシネーションを何度も出力しがちなので、結果はキャッシュしておく
 
     Args:
         text (str): Whisper で書き起こされたテキスト
@@ -183,8 +245,7 @@ def PrepareText(text: str) -> str:
     # 入力テキストに 1 つでもひらがな・カタカナ・漢字が含まれる場合のみ、日本語として処理する
     # ref: https://note.nkmk.me/python-re-regex-character-type/
     is_japanese = False
-    hiragana_katakana_kanji_pattern = regex.compile(r'\p{Hiragana}|\p{Katakana}|\p{Han}')
-    if hiragana_katakana_kanji_pattern.search(text):
+    if HIRAGANA_KATAKANA_KANJI_PATTERN.search(text):
         is_japanese = True
 
     # 半角の ､｡!? を 全角の 、。！？ に置換する
@@ -211,29 +272,29 @@ def PrepareText(text: str) -> str:
 
     # 先頭に 、。！？ がある場合は削除する
     if is_japanese is True:
-        text = re.sub(r'^[、。！？]+', '', text)
+        text = LEADING_PUNCTUATION_JA_PATTERN.sub('', text)
     else:
-        text = re.sub(r'^[,.!?]+', '', text)
+        text = LEADING_PUNCTUATION_EN_PATTERN.sub('', text)
 
     # 同じ文字が4文字以上続いていたら (例: ～～～～～～～～！！)、2文字にする (例: ～～！！)
-    text = re.sub(r'(.)\1{3,}', r'\1\1', text)
+    text = REPEATED_CHARACTER_PATTERN.sub(r'\1\1', text)
 
     # 中間にある空白文字 (半角/全角の両方) を 、に置換する
     if is_japanese is True:
-        text = re.sub(r'[ 　]', '、', text)
+        text = SPACE_PATTERN.sub('、', text)
 
     # （）や【】「」で囲われた文字列を削除する
-    text = re.sub(r'（.*?）', '', text)
-    text = re.sub(r'【.*?】', '', text)
-    text = re.sub(r'「.*?」', '', text)
+    text = ROUND_BRACKETS_PATTERN.sub('', text)
+    text = LENTICULAR_BRACKETS_PATTERN.sub('', text)
+    text = CORNER_BRACKETS_PATTERN.sub('', text)
 
     # 念押しで前後の空白を削除する
     text = text.strip()
 
     # 連続する句読点を1つにまとめる
     if is_japanese is True:
-        text = re.sub(r'([、。！？])\1+', r'\1', text)
+        text = REPEATED_PUNCTUATION_JA_PATTERN.sub(r'\1', text)
     else:
-        text = re.sub(r'([,\.!\?])\1+', r'\1', text)
+        text = REPEATED_PUNCTUATION_EN_PATTERN.sub(r'\1', text)
 
     return text
@@ -1,7 +1,29 @@
 
+import functools
+import json
+import math
 import os
-import requests
+import shutil
+import signal
+import threading
 from pathlib import Path
+from typing import Any
+
+# orjson は stdlib の json よりも大幅に高速にシリアライズ・デシリアライズできる
+## Gradio の依存関係として導入されているはずだが、念のためインストールされていない場合は stdlib の json にフォールバックする
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# fcntl は Windows には存在しないため、その場合は reflink によるコピーを行わない
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux の FICLONE ioctl の番号 (Btrfs や XFS などで、ファイルのデータを共有した Copy-on-Write なコピーを作成する)
+FICLONE = 0x40049409
 
 
 def DownloadFile(url: str, path: Path) -> None:
@@ -13,6 +35,9 @@ def DownloadFile(url: str, path: Path) -> None:
         path (str): ダウンロードしたファイルの保存先
     """
 
+    # requests はインポートが比較的重く、train 以外のサブコマンドでは使わないため、ここでインポートする
+    import requests
+
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
         with open(path, mode='wb') as f:
@@ -20,9 +45,145 @@ def DownloadFile(url: str, path: Path) -> None:
                 f.write(chunk)
 
 
+def CloneOrCopyFile(src: Path | str, dst: Path | str) -> None:
+    """
+    ファイルを reflink (Copy-on-Write) でコピーする
+    ファイルシステムが reflink に対応していない場合は、通常通りファイルをコピーする
+
+    Args:
+        src (Path | str): コピー元のファイルのパス
+        dst (Path | str): コピー先のファイルのパス
+    """
+
+    # コピー先がコピー元と同じファイル (ハードリンク) の場合は、既に同じ内容なので何もしない
+    ## そのままコピー先を書き込みモードで開くと、コピー元のデータごと切り詰められて消えてしまう
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+
+    # コピー先の隣の一時ファイルにコピーしてから置き換える
+    ## コピーに失敗したり途中で中断されたりしても、既存のコピー先のファイルが壊れないようにする
+    tmp_dst = f'{dst}.tmp'
+    try:
+        # reflink ならデータのコピーが発生しないため、ファイルサイズに関わらず一瞬で完了する
+        ## ハードリンクと異なり、コピー先のファイルを書き換えてもコピー元のファイルには影響しない
+        cloned = False
+        if fcntl is not None:
+            try:
+                with open(src, mode='rb') as src_file, open(tmp_dst, mode='wb') as dst_file:
+                    fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                cloned = True
+            except OSError:
+                pass
+        if cloned is False:
+            shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+
+
+def LinkOrCopyFile(src: Path | str, dst: Path | str) -> None:
+    """
+    ファイルをハードリンクとして配置する
+    別のファイルシステム間などでハードリンクを作成できない場合は、reflink か通常のコピーでファイルをコピーする
+
+    Args:
+        src (Path | str): 配置元のファイルのパス
+        dst (Path | str): 配置先のファイルのパス
+    """
+
+    # ハードリンクならデータのコピーが発生しないため、ファイルサイズに関わらず一瞬で完了する
+    ## 配置先にファイルが既に存在する場合も OSError になるので、CloneOrCopyFile() で上書きさせる
+    try:
+        os.link(src, dst)
+    except OSError:
+        CloneOrCopyFile(src, dst)
+
+
+def LoadJSONFile(path: Path) -> Any:
+    """
+    JSON ファイルを読み込む
+
+    Args:
+        path (Path): 読み込む JSON ファイルのパス
+
+    Returns:
+        Any: 読み込んだデータ
+    """
+
+    # orjson は NaN や Infinity を含む JSON を読み込めないため、その場合は stdlib の json で読み込み直す
+    data = path.read_bytes()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def __ContainsNonFiniteFloat(data: Any) -> bool:
+    """
+    データに NaN や Infinity などの有限でない浮動小数点数が含まれているかどうかを返す
+
+    Args:
+        data (Any): 判定するデータ
+
+    Returns:
+        bool: 有限でない浮動小数点数が含まれているかどうか
+    """
+
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(__ContainsNonFiniteFloat(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(__ContainsNonFiniteFloat(value) for value in data)
+    return False
+
+
+def SaveJSONFile(path: Path, data: Any) -> None:
+    """
+    データを JSON ファイルに書き込む
+    orjson の制約上、インデントは常に 2 スペースになる
+    書き込み途中で中断されても壊れた JSON ファイルが残らないよう、一時ファイルに書き込んでから置き換える
+
+    Args:
+        path (Path): 書き込む JSON ファイルのパス
+        data (Any): 書き込むデータ
+    """
+
+    # orjson は NaN や Infinity を黙って null として書き込んでしまい、読み込み直すと数値ではなく None になってしまう
+    ## そのため、データに有限でない浮動小数点数が含まれている場合は、NaN や Infinity をそのまま書き込める stdlib の json を使う
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    if orjson is not None and not __ContainsNonFiniteFloat(data):
+        tmp_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False, allow_nan=True)
+    os.replace(tmp_path, path)
+
+
+def SaveTextFile(path: Path, text: str) -> None:
+    """
+    テキストを UTF-8 でファイルに書き込む
+    書き込み途中で中断されても壊れたファイルが残らないよう、一時ファイルに書き込んでから置き換える
+
+    Args:
+        path (Path): 書き込むファイルのパス
+        text (str): 書き込むテキスト
+    """
+
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+@functools.lru_cache(maxsize=None)
 def GetTerminalColumnSize() -> int:
     """
     ターミナルの列のサイズを取得する
+    区切り線の出力のたびに呼ばれるため、結果はターミナルのサイズが変更されるまでキャッシュしておく
 
     Returns:
         int: ターミナルの列のサイズ
@@ -35,6 +196,22 @@ def GetTerminalColumnSize() -> int:
         return 80
 
 
+def InstallTerminalResizeHandler() -> None:
+    """
+    ターミナルのサイズが変更されたら、キャッシュしているターミナルの列のサイズを破棄するシグナルハンドラーを登録する
+    モジュールのインポート時に登録すると、Demucs のワーカープロセスなどでもハンドラーが上書きされてしまうため、CLI のエントリーポイントから呼び出す
+    SIGWINCH が存在しない (Windows) 場合・メインスレッド以外から呼ばれた場合・既に他のハンドラーが登録されている場合は何もしない
+    """
+
+    if not hasattr(signal, 'SIGWINCH'):
+        return
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGWINCH) not in (signal.SIG_DFL, None):
+        return
+    signal.signal(signal.SIGWINCH, lambda signum, frame: GetTerminalColumnSize.cache_clear())
+
+
 def SecondToTimeCode(second: float) -> str:
     """
     秒数をタイムコード (HH:MM:SS.mmm) に変換する